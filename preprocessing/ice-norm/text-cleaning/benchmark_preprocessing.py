@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compares preprocessing.clean, with its precompiled patterns, to the cleaning steps as they were written before
+(compiling the patterns on every call and replacing dashes one match at a time), checks that the output is
+the same and reports the time of both.
+
+    python3 benchmark_preprocessing.py corpus.txt [--repeat 5]
+
+"""
+
+import argparse
+import re
+import time
+
+import char_constants
+import preprocessing
+
+
+def delete_non_conform_symbols(line):
+    non_valid = re.compile(char_constants.NON_VALID_CHARS)
+    return re.sub(non_valid, '', line)
+
+
+def remove_dashes(line):
+    replaced = line
+    pattern = re.compile(preprocessing.LETTERS + r'-\s*' + preprocessing.LETTERS)
+    for m in re.finditer(pattern, line):
+        substr = m.group()
+        replaced = replaced.replace(substr, substr.replace('-', ' '))
+    return replaced
+
+
+def replace_e_mail(line):
+    match = re.search(r'[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]{2,4}', line)
+    if match:
+        return line.replace(match.group(), '')
+    return line
+
+
+def replace_pattern(regex, text):
+    pattern = re.compile(regex, re.IGNORECASE)
+    m = pattern.match(text)
+    res = text
+    if m:
+        for g in m.groups():
+            if g:
+                res = res.replace(g, '')
+    return res.strip()
+
+
+def clean_web_page_labels(line):
+    if re.search(preprocessing.WEBPAGE_LOC, line):
+        if re.search('(Gestabók)|(Viðburðir)', line):
+            return ''
+        tokens = preprocessing.word_tokenize(line)
+        anchor_ind = tokens.index(':')
+        text = ' '.join(tokens[anchor_ind + 4:])
+        return text.replace('án commenta', '')
+
+    res = replace_pattern(r'(^innlent)?.+(meira forsíða\.\.$)', line)
+    res = replace_pattern(r'(^innlent)?.+(forsíða\.\.$)', res)
+    return res.strip()
+
+
+def reference_clean(line):
+    processed_line = delete_non_conform_symbols(line)
+    processed_line = remove_dashes(processed_line)
+    processed_line = replace_e_mail(processed_line)
+    return clean_web_page_labels(processed_line)
+
+
+# Lines that exercise each step, including dashes that only the match-by-match replacement removes
+EXTRA_LINES = [
+    'Innlent - 8. maí 2008, 12:46 Geysir Green mátti kaupa Jarðborun Forsíða..',
+    'innlent fréttir í dag meira forsíða..',
+    '11 Nýársmessa í Holtskirkju Þú ert hér: bb.is  Forsíða  Grein án commenta Kreppan er að baki.',
+    'Ritstjórn DV (ritstjorn@dv.is) «svarar» „spurningum“ um Suður-Kóreu.',
+    'Suður-Ameríku-ríki og Ameríku-ríki, félags- og tryggingamál, 91-97 og tröll - Stóðhestsefni',
+    'a-b-c a-b ' * 50,
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the precompiled preprocessing against the previous implementation')
+    parser.add_argument('corpus', type=argparse.FileType('r', encoding='UTF-8'), help='Text to clean, one sentence per line')
+    parser.add_argument('--repeat', type=int, default=1, help='Clean the corpus this many times')
+    parser.add_argument('--tokenizer', choices=preprocessing.TOKENIZERS, default='nltk', help='Tokenizer of the web page labels')
+    args = parser.parse_args()
+    preprocessing.set_tokenizer(args.tokenizer)
+
+    lines = [line.strip() for line in args.corpus] + EXTRA_LINES
+    lines = lines * args.repeat
+
+    t0 = time.time()
+    new = [preprocessing.clean(line) for line in lines]
+    t1 = time.time()
+    old = [reference_clean(line) for line in lines]
+    t2 = time.time()
+
+    for line, a, b in zip(lines, new, old):
+        assert a == b, '{!r} gives {!r}, expected {!r}'.format(line, a, b)
+    print('{} lines, same output, precompiled {:.2f}s, previous {:.2f}s ({:.1f}x)'.format(
+        len(lines), t1 - t0, t2 - t1, (t2 - t1) / max(t1 - t0, 1e-9)))
+
+
+if __name__ == '__main__':
+    main()
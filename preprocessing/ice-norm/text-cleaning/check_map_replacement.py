@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+"""
+Checks that the one-pass acronym, abbreviation and symbol replacement in map_replacement gives the same output as
+replacing the keys one by one (for symbols, the same words), and compares their speed. The lines are random sequences of map keys
+(with and without a final period), common words and punctuation, and optionally the lines of a corpus.
+
+    python3 check_map_replacement.py [--corpus data.txt] [--lines 100000]
+
+"""
+
+import argparse
+import random
+import time
+
+import map_replacement
+
+
+def random_lines(maps, num_lines, seed=0):
+    rng = random.Random(seed)
+    tokens = list(maps.acronym_map) + list(maps.abbr_map) + [key + '.' for key in maps.abbr_map]
+    tokens += ['og', 'í', 'að', 'er', 'á', 'það', 'sem', 'til', 'við', 'Helga', ',', '.', '%', '5%', '']
+    return [' '.join([rng.choice(tokens) for _ in range(rng.randint(0, 30))]) for _ in range(num_lines)]
+
+
+def check(name, fast, reference, lines):
+    t0 = time.time()
+    fast_out = [fast(line) for line in lines]
+    t1 = time.time()
+    reference_out = [reference(line) for line in lines]
+    t2 = time.time()
+
+    for line, a, b in zip(lines, fast_out, reference_out):
+        assert a == b, '{}: {!r} gives {!r}, expected {!r}'.format(name, line, a, b)
+    print('{}: {} lines, same output, one pass {:.2f}s, one key at a time {:.2f}s'.format(name, len(lines), t1 - t0, t2 - t1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the one-pass map replacement to the key by key replacement')
+    parser.add_argument('--corpus', type=argparse.FileType('r', encoding='UTF-8'), default=None, help='Also check the lines of this file')
+    parser.add_argument('--lines', type=int, default=100000, help='Number of random lines')
+    args = parser.parse_args()
+
+    maps = map_replacement.ReplacementMaps.load()
+    lines = random_lines(maps, args.lines)
+    if args.corpus:
+        lines += [' ' + line.strip() + ' ' for line in args.corpus]
+
+    check('acronyms', maps.replace_acronyms, maps.replace_acronyms_sequential, lines)
+    check('abbreviations', maps.replace_abbreviations, maps.replace_abbreviations_sequential, lines)
+    check('symbols', lambda line: ' '.join(maps.replace_symbols(line).split()),
+          lambda line: ' '.join(maps.replace_symbols_sequential(line).split()), lines)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,9 +6,19 @@ but a selective normalizing should also be possible as work on the module procee
 
 """
 
+import sys
+import time
+_import_start = time.time()
+
 import argparse
+from itertools import islice
+from multiprocessing import Pool
+
 import preprocessing
 import map_replacement
+from normalization_cache import NormalizationCache, normalizer_digest
+
+IMPORT_TIME = time.time() - _import_start
 
 
 def parse_args():
@@ -16,25 +26,118 @@ def parse_args():
     parser.add_argument('i', type=argparse.FileType('r', encoding='UTF-8'), help='Input data set')
     parser.add_argument('o', type=argparse.FileType('w', encoding='UTF-8'), help='Output file')
     parser.add_argument('--normalizing_steps', default=[])
+    parser.add_argument('--maps_cache', default=None,
+                        help='Pickle the compiled replacement maps to this file and reuse them while the mapping files are unchanged')
+    parser.add_argument('--tokenizer', choices=preprocessing.TOKENIZERS, default='nltk',
+                        help="Word tokenizer: nltk.word_tokenize (the punkt models must be installed) or a simple regex tokenizer")
+    parser.add_argument('--cache', default=None,
+                        help='sqlite database of normalized lines. Lines normalized before (with the same mapping tables, '
+                             'code and tokenizer) are taken from it, and new lines are added')
+    parser.add_argument('--jobs', type=int, default=1, help='Number of processes that normalize the input')
+    parser.add_argument('--chunk_size', type=int, default=10000,
+                        help='Number of lines read, normalized (by one process) and written at a time')
 
     return parser.parse_args()
 
 
+def read_chunks(in_file, chunk_size):
+    while True:
+        chunk = list(islice(in_file, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+_cache = None
+
+
+def init_worker(maps_cache, tokenizer, cache_path, cache_digest):
+    global _cache
+    preprocessing.set_tokenizer(tokenizer)
+    map_replacement.get_replacement_maps(maps_cache)
+    if cache_path:
+        _cache = NormalizationCache(cache_path, cache_digest)
+
+
+def normalize_line(line, repl):
+    """
+    :param line:
+    :param repl: ReplacementMaps
+    :return: the normalized line, or None if it is empty after preprocessing (and is dropped)
+    """
+    preprocessed_line = preprocessing.process(line)
+
+    if len(preprocessed_line) != 0:
+        return map_replacement.replace_from_maps(preprocessed_line, repl)
+    return None
+
+
+def normalize_chunk(lines):
+    """
+    Normalize a list of lines. Lines that are empty after preprocessing are dropped.
+    With a cache, only the lines that aren't in it are normalized.
+
+    :param lines:
+    :return: the normalized lines as one string, one line per normalized line, the new (key, line) cache entries,
+    and the number of lines taken from the cache (hits) and normalized (misses)
+    """
+    repl = map_replacement.get_replacement_maps()
+    lines = [line.strip() for line in lines]
+    keys = [_cache.key(line) for line in lines] if _cache else None
+    cached = _cache.lookup(keys) if _cache else {}
+
+    processed_lines = []
+    new_entries = []
+    for i, line in enumerate(lines):
+        if keys and keys[i] in cached:
+            processed_line = cached[keys[i]]
+        else:
+            processed_line = normalize_line(line, repl)
+            if keys:
+                new_entries.append((keys[i], processed_line))
+                cached[keys[i]] = processed_line
+
+        if processed_line is not None:
+            processed_lines.append(processed_line + '\n')
+
+    return ''.join(processed_lines), new_entries, len(lines) - len(new_entries), len(new_entries)
+
+
 def main():
 
     args = parse_args()
-    text = args.i.readlines()
 
-    processed_lines = []
-    for line in text:
-        preprocessed_line = preprocessing.process(line.strip())
+    # Everything is loaded before the workers are started, which then share it
+    t0 = time.time()
+    cache_digest = normalizer_digest(args.tokenizer) if args.cache else None
+    init_args = (args.maps_cache, args.tokenizer, args.cache, cache_digest)
+    init_worker(*init_args)
+    if _cache:
+        _cache.create()
+    sys.stderr.write('Imported the normalizer in {:.3f}s, loaded the {} tokenizer and the maps in {:.3f}s\n'.format(
+        IMPORT_TIME, args.tokenizer, time.time() - t0))
 
-        if len(preprocessed_line) != 0:
-            processed_line = map_replacement.replace_from_maps(preprocessed_line)
-            processed_lines.append(processed_line)
+    # The input is streamed in chunks, which a pool of processes normalizes in parallel with --jobs.
+    # The normalized chunks are written in input order, and new cache entries are added by this process.
+    chunks = read_chunks(args.i, args.chunk_size)
+    pool = Pool(args.jobs, init_worker, init_args) if args.jobs > 1 else None
+    try:
+        results = pool.imap(normalize_chunk, chunks) if pool else map(normalize_chunk, chunks)
+        for block, new_entries, hits, misses in results:
+            args.o.write(block)
+            if _cache:
+                _cache.add(new_entries)
+                _cache.hits += hits
+                _cache.misses += misses
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
 
-    for line in processed_lines:
-        args.o.write(line + '\n')
+    if _cache:
+        _cache.close()
+        sys.stderr.write('Normalization cache: {} hits, {} misses ({:.1f}% hits)\n'.format(
+            _cache.hits, _cache.misses, 100 * _cache.hits / max(_cache.hits + _cache.misses, 1)))
 
     # for line in processed_lines:
     #   if re.search('[^' + char_constants.LETTERS + ',. ]+', line):
@@ -6,20 +6,144 @@ Uses replacement mapping files to replace symbols and strings in input using the
 
 """
 
+import os
 import re
+import pickle
 
-mp_file_path = '../mapping_tables/'
+mp_file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'mapping_tables', '')
 acro_file = 'acros.txt'
 abbr_file = 'abbr.txt'
 symbol_file = 'symbol_mapping.txt'
+# Bump when the attributes of ReplacementMaps change, so that older pickled maps are not used
+MAPS_CACHE_VERSION = 3
+
+
+def mapping_files_key(path=mp_file_path):
+    """Name, mtime and size of each mapping file. A cached ReplacementMaps is only used if these match."""
+    key = []
+    for filename in [acro_file, abbr_file, symbol_file]:
+        stat = os.stat(path + filename)
+        key.append((filename, stat.st_mtime_ns, stat.st_size))
+    return tuple(key)
+
+
+# Abbreviation keys that are analysed for the one-pass scan: literal characters and '.' (any character)
+SIMPLE_ABBREVIATION = re.compile(r'[^\\^$*+?{}\[\]|()]+')
+
+
+def abbreviation_windows(key):
+    """
+    The strings ' key\\.? ' matches, as lists of characters with None for the positions any character
+    can fill: one without and one with the optional period.
+    """
+    chars = [None if c == '.' else c for c in key]
+    return [[' '] + chars + [' '], [' '] + chars + ['.', ' ']]
+
+
+def build_trie(sequences):
+    """
+    A trie of the given (id, sequence) pairs. Each node is a list of a dict from characters (None for any
+    character) to the child nodes, the ids of the sequences that end at the node, and the ids of all the
+    sequences below it once subtree_ids has collected them.
+    """
+    root = [{}, [], None]
+    for ident, sequence in sequences:
+        node = root
+        for c in sequence:
+            child = node[0].get(c)
+            if child is None:
+                child = node[0][c] = [{}, [], None]
+            node = child
+        node[1].append(ident)
+    return root
+
+
+def subtree_ids(node):
+    """The ids of the sequences that end at or below node"""
+    if node[2] is None:
+        ids = set(node[1])
+        for child in node[0].values():
+            ids |= subtree_ids(child)
+        node[2] = ids
+    return node[2]
+
+
+def trie_matches(trie, chars, partial=True):
+    """
+    The ids of the sequences in trie that can be placed at the start of chars, where the two agree on every
+    character they share (None matches any character): the sequences that fit in chars, and if partial is
+    set, also those that begin with all of chars and go on past its end.
+    """
+    found = set()
+    nodes = [trie]
+    for c in chars:
+        if c is None:
+            nodes = [child for children, _, _ in nodes for child in children.values()]
+        else:
+            nodes = [children[d] for children, _, _ in nodes for d in (c, None) if d in children]
+        if not nodes:
+            return found
+        for node in nodes:
+            found.update(node[1])
+    if partial:
+        for node in nodes:
+            found |= subtree_ids(node)
+    return found
 
 
 class ReplacementMaps:
 
-    def __init__(self):
+    def __init__(self, path=mp_file_path):
+        self.path = path
         self.acronym_map = {}
+        self.acronym_pattern = None
         self.abbr_map = {}
+        self.abbr_patterns = []
+        self.abbr_pattern = None
+        self.abbr_scan_pattern = None
+        self.abbr_keys = []
+        self.abbr_overlaps = {}
+        self.abbr_overlap_patterns = {}
+        self.abbr_creates = set()
+        self.abbr_max_length = 0
         self.symbol_map = {}
+        self.symbol_pattern = None
+        self.symbol_sequential_keys = []
+
+    @classmethod
+    def load(cls, path=mp_file_path, cache_file=None):
+        """
+        Read all maps and compile their patterns once. If cache_file is given, the compiled maps are
+        pickled there and reused by later calls, for as long as the mapping files are unchanged.
+
+        :param path: directory of the mapping files
+        :param cache_file: optional path of the pickled maps
+        :return: a ReplacementMaps with all maps loaded
+        """
+        key = (MAPS_CACHE_VERSION, mapping_files_key(path))
+        if cache_file and os.path.exists(cache_file):
+            try:
+                with open(cache_file, 'rb') as f:
+                    cached_key, maps = pickle.load(f)
+                if cached_key == key:
+                    return maps
+            except Exception:
+                # unreadable, or pickled by other versions of the modules: rebuild it
+                pass
+
+        maps = cls(path)
+        maps.get_acronym_map()
+        maps.get_abbreviation_map()
+        maps.get_symbol_map()
+
+        if cache_file:
+            try:
+                with open(cache_file + '.tmp', 'wb') as f:
+                    pickle.dump((key, maps), f, pickle.HIGHEST_PROTOCOL)
+                os.replace(cache_file + '.tmp', cache_file)
+            except OSError:
+                pass
+        return maps
 
     @staticmethod
     def read_file(filename):
@@ -38,37 +162,258 @@ class ReplacementMaps:
 
     def get_acronym_map(self):
         if not self.acronym_map:
-            acr_list = self.read_file(mp_file_path + acro_file)
+            acr_list = self.read_file(self.path + acro_file)
             self.acronym_map = self.create_map_from_list(acr_list)
+            self.acronym_pattern = self.compile_acronym_pattern(self.acronym_map)
         return self.acronym_map
 
     def get_abbreviation_map(self):
         if not self.abbr_map:
-            abbr_list = self.read_file(mp_file_path + abbr_file)
+            abbr_list = self.read_file(self.path + abbr_file)
             self.abbr_map = self.create_map_from_list(abbr_list)
+            self.abbr_patterns = [(re.compile(' ' + key + r'\.? '), ' ' + self.abbr_map[key] + ' ')
+                                  for key in self.abbr_map]
+            # the keys are regular expressions, so this matches wherever any one of the patterns matches
+            if self.abbr_map:
+                self.abbr_pattern = re.compile('|'.join(['(?: ' + key + r'\.? )' for key in self.abbr_map]))
+            conflicts = self.abbreviation_conflicts(self.abbr_map)
+            if self.abbr_map and conflicts is not None:
+                overlaps, self.abbr_creates = conflicts
+                self.abbr_keys = list(self.abbr_map)
+                # the leading space is part of the match and the trailing one is not, so that a match can start
+                # where the previous one ended; the empty group after each key tells which key matched
+                self.abbr_scan_pattern = re.compile('|'.join([' ' + key + r'\.?()(?= )' for key in self.abbr_keys]))
+                index = dict((key, i) for i, key in enumerate(self.abbr_keys))
+                for key in self.abbr_keys:
+                    others = sorted(overlaps[key] - {key}, key=index.get)
+                    self.abbr_overlaps[key] = (others, others + [key] if key in overlaps[key] else others)
+                self.abbr_max_length = max([len(key) for key in self.abbr_keys])
         return self.abbr_map
 
     def get_symbol_map(self):
         if not self.symbol_map:
-            symbol_list = self.read_file(mp_file_path + symbol_file)
+            symbol_list = self.read_file(self.path + symbol_file)
             self.symbol_map = self.create_map_from_list(symbol_list)
+            scan_keys = self.symbol_scan_keys(self.symbol_map)
+            if scan_keys is not None:
+                if scan_keys:
+                    self.symbol_pattern = re.compile('|'.join([re.escape(key) for key in self.symbol_map if key in scan_keys]))
+                self.symbol_sequential_keys = [key for key in self.symbol_map if key not in scan_keys]
         return self.symbol_map
 
+    @staticmethod
+    def compile_acronym_pattern(acronym_map):
+        """
+        One alternation of all acronyms, matching whole space separated tokens. Returns None if the
+        acronyms can't be replaced in one pass with the same result as replacing them one by one:
+        when an acronym is empty or contains a space, or a replacement contains an acronym.
+
+        :param acronym_map:
+        :return: compiled pattern or None
+        """
+        if not acronym_map:
+            return None
+        for key, value in acronym_map.items():
+            if not key or ' ' in key:
+                return None
+            if any(token in acronym_map for token in value.split(' ')):
+                return None
+        keys = sorted(acronym_map, key=len, reverse=True)
+        return re.compile('(?<= )(?:' + '|'.join([re.escape(key) for key in keys]) + ')(?= )')
+
+    @staticmethod
+    def abbreviation_conflicts(abbr_map):
+        """
+        Find the abbreviations whose order can matter when they are replaced in one scan instead of one key at
+        a time: pairs of keys with matches that can overlap (a key can also overlap itself at another position)
+        other than by sharing the space between them, and keys whose replacement can make a new match of a later
+        key. Returns None if the keys can't be analysed: when a key is not made of literal characters and '.'
+        (any character), or a replacement contains a backslash, which sub would expand.
+
+        :param abbr_map:
+        :return: (dict from each key to the set of keys it can overlap, set of keys whose replacement can
+                 make a match) or None
+        """
+        keys = list(abbr_map)
+        windows = []
+        for key in keys:
+            if not SIMPLE_ABBREVIATION.fullmatch(key) or '\\' in abbr_map[key]:
+                return None
+            windows.extend(abbreviation_windows(key))
+        # Window w is one of the two of keys[w // 2]. Two windows overlap when one can be placed at some offset in
+        # the other; every offset is found from the window that starts first (or from both, at offset 0) by
+        # looking up the windows that fit from there on.
+        window_trie = build_trie(enumerate(windows))
+        overlaps = dict((key, set()) for key in keys)
+        for i, key in enumerate(keys):
+            found = set()
+            for w in (2 * i, 2 * i + 1):
+                window = windows[w]
+                # the last offset only shares the space between the two
+                for offset in range(len(window) - 1):
+                    matches = trie_matches(window_trie, window[offset:])
+                    if offset == 0:
+                        matches.discard(w)
+                    found.update(other // 2 for other in matches)
+            overlaps[key].update(keys[j] for j in found)
+            for j in found:
+                overlaps[keys[j]].add(key)
+        # A replacement is ' value ' in place of the match with its spaces; a match that takes more than one of its
+        # characters is new. Only the keys after this one are replaced in the text with the replacement. A window
+        # that starts inside the replacement is found as above; one that starts before it, from the suffixes of
+        # the windows that the replacement can begin.
+        suffix_trie = build_trie((w, window[start:]) for w, window in enumerate(windows)
+                                 for start in range(1, len(window) - 1))
+        creates = set()
+        for i, key in enumerate(keys):
+            replaced = [' '] + list(abbr_map[key]) + [' ']
+            found = trie_matches(suffix_trie, replaced)
+            for offset in range(len(replaced) - 1):
+                found |= trie_matches(window_trie, replaced[offset:])
+            if found and max(found) // 2 > i:
+                creates.add(key)
+        return overlaps, creates
+
+    @staticmethod
+    def symbol_scan_keys(symbol_map):
+        """
+        The symbols that can be replaced in one scan of all of them, with the same result (up to spaces) as
+        replacing them one by one: those that can't overlap another symbol and can't be found in the replacement
+        of another symbol. Returns None if a symbol contains a space, since the spaces then depend on the
+        order of the replacements.
+
+        :param symbol_map:
+        :return: set of keys or None
+        """
+        if any(not key or ' ' in key for key in symbol_map):
+            return None
+        keys = list(symbol_map)
+        trie = build_trie(enumerate(keys))
+        conflicts = set()
+        for i, key in enumerate(keys):
+            # the symbols that start inside this one and overlap it, and those in its replacement
+            found = set()
+            for offset in range(len(key)):
+                found |= trie_matches(trie, key[offset:])
+            for offset in range(len(symbol_map[key])):
+                found |= trie_matches(trie, symbol_map[key][offset:], partial=False)
+            found.discard(i)
+            if found:
+                conflicts |= found
+                conflicts.add(i)
+        conflicts = set(keys[i] for i in conflicts)
+        return set(keys) - conflicts
+
     def replace_acronyms(self, line):
+        """
+        Replace the acronyms in one scan. Gives the same result as replace_acronyms_sequential, including
+        for repeated acronyms: replacing ' KSÍ ' in 'a KSÍ KSÍ KSÍ b' uses up the space before the second
+        one, so only the first and third are replaced.
+        """
+        self.get_acronym_map()
+        if self.acronym_pattern is None:
+            return self.replace_acronyms_sequential(line)
+
+        out = []
+        start = 0
+        previous = None
+        for m in self.acronym_pattern.finditer(line):
+            key = m.group()
+            if previous == (key, m.start() - 1):
+                previous = None
+                continue
+            out.append(line[start:m.start()])
+            out.append(self.acronym_map[key])
+            start = m.end()
+            previous = (key, m.end())
+
+        if not out:
+            return line
+        out.append(line[start:])
+        return ''.join(out)
+
+    def replace_acronyms_sequential(self, line):
         res = line
         for key in self.get_acronym_map():
             res = res.replace(' ' + key + ' ', ' ' + self.acronym_map[key] + ' ')
 
         return res
 
+    def abbreviation_overlapped(self, line, m, key):
+        """
+        Whether the match m of key in the scan overlaps a match of a key it can overlap: one that starts at the
+        same space, or inside m.
+        """
+        if key not in self.abbr_overlap_patterns:
+            # compiled for the keys that are found, since a large map has too many to compile them all up front
+            self.abbr_overlap_patterns[key] = tuple(re.compile(' (?:' + '|'.join(keys) + r')\.?(?= )') if keys else None
+                                                    for keys in self.abbr_overlaps[key])
+        same_start, inside = self.abbr_overlap_patterns[key]
+        if same_start is not None and same_start.match(line, m.start()):
+            return True
+        if inside is not None:
+            o = inside.search(line, m.start() + 1, min(len(line), m.end() + self.abbr_max_length + 3))
+            if o is not None and o.start() < m.end():
+                return True
+        return False
+
     def replace_abbreviations(self, line):
+        """
+        Replace the abbreviations in one scan of all keys, in which the group of a match gives its key. As in
+        replace_acronyms, a match right after a replaced match of the same key is not replaced, since the pattern
+        of the key used up the space between them. When the order of the keys can matter for the line (see
+        abbreviation_conflicts), because a match overlaps a match of another key or a replacement could make a new
+        match, the line is replaced one key at a time. Gives the same result as replace_abbreviations_sequential.
+        """
+        self.get_abbreviation_map()
+        if self.abbr_pattern is None or not self.abbr_pattern.search(line):
+            return line
+        if self.abbr_scan_pattern is None:
+            return self.replace_abbreviations_sequential(line)
+
+        state = {'previous': None, 'ordered': False}
+
+        def repl(m):
+            key = self.abbr_keys[m.lastindex - 1]
+            if key in self.abbr_creates or self.abbreviation_overlapped(line, m, key):
+                state['ordered'] = True
+            if state['previous'] == (key, m.start()):
+                state['previous'] = None
+                return m.group()
+            state['previous'] = (key, m.end())
+            return ' ' + self.abbr_map[key]
+
+        res = self.abbr_scan_pattern.sub(repl, line)
+        if state['ordered']:
+            return self.replace_abbreviations_sequential(line)
+        return res
+
+    def replace_abbreviations_sequential(self, line):
         res = line
-        for key in self.get_abbreviation_map():
-            res = re.sub(' ' + key + '\.? ', ' ' + self.abbr_map[key] + ' ', res)
+        self.get_abbreviation_map()
+        for pattern, repl in self.abbr_patterns:
+            res = pattern.sub(repl, res)
 
         return res
 
     def replace_symbols(self, line):
+        """
+        Replace the symbols found by symbol_scan_keys in one scan, then the others one by one. The words are the
+        same as with replace_symbols_sequential, which also collapses double spaces after every symbol, but the
+        spaces between them can differ; replace_from_maps splits the line into words after this.
+        """
+        self.get_symbol_map()
+        if self.symbol_pattern is None and not self.symbol_sequential_keys:
+            return self.replace_symbols_sequential(line)
+
+        res = line
+        if self.symbol_pattern is not None:
+            res = self.symbol_pattern.sub(lambda m: ' ' + self.symbol_map[m.group()] + ' ', res)
+        for key in self.symbol_sequential_keys:
+            res = res.replace(key, ' ' + self.symbol_map[key] + ' ')
+        return res
+
+    def replace_symbols_sequential(self, line):
         res = line
         for key in self.get_symbol_map():
             res = res.replace(key, ' ' + self.symbol_map[key] + ' ')
@@ -76,9 +421,24 @@ class ReplacementMaps:
 
         return res
 
+    def replace(self, line):
+        return replace_from_maps(line, self)
+
+
+_replacement_maps = None
+
+
+def get_replacement_maps(cache_file=None):
+    """The ReplacementMaps of this process, loaded on first use"""
+    global _replacement_maps
+    if _replacement_maps is None:
+        _replacement_maps = ReplacementMaps.load(cache_file=cache_file)
+    return _replacement_maps
+
 
-def replace_from_maps(line):
-    repl = ReplacementMaps()
+def replace_from_maps(line, repl=None):
+    if repl is None:
+        repl = get_replacement_maps()
 
     res = repl.replace_acronyms(line)
     res = repl.replace_abbreviations(res)
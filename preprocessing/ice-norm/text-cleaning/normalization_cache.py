@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+"""
+On-disk cache of normalized lines, so that re-normalizing a corpus that is mostly the same as before only costs
+time for the new lines. The cache is an sqlite database of the normalized lines keyed by a hash of the input line
+and of everything the normalization depends on: the mapping tables, the normalization code and the tokenizer.
+Changing any of them gives new keys, and the old entries are no longer used.
+
+Several processes can read the cache while one writes to it (the database is in WAL mode).
+
+"""
+
+import hashlib
+import os
+import sqlite3
+
+import char_constants
+import map_replacement
+import preprocessing
+
+# sqlite limits the number of parameters in one statement
+LOOKUP_BATCH_SIZE = 500
+
+
+def normalizer_digest(tokenizer='nltk', path=map_replacement.mp_file_path):
+    """
+    Hash of the mapping tables, the source of the normalization modules and the tokenizer name.
+
+    :param tokenizer:
+    :param path: directory of the mapping files
+    :return: sha1 digest (bytes)
+    """
+    digest = hashlib.sha1()
+    filenames = [path + map_replacement.acro_file, path + map_replacement.abbr_file, path + map_replacement.symbol_file]
+    filenames += [module.__file__ for module in [char_constants, map_replacement, preprocessing]]
+    for filename in filenames:
+        with open(filename, 'rb') as f:
+            digest.update(f.read())
+    digest.update(tokenizer.encode('utf-8'))
+    return digest.digest()
+
+
+class NormalizationCache:
+
+    def __init__(self, path, digest):
+        self.path = path
+        self.digest = digest
+        self.hits = 0
+        self.misses = 0
+        self.conn = None
+        self.pid = None
+
+    def create(self):
+        """
+        Create the table if the database is new and put the database in WAL mode. This is done once, by the process
+        that writes to the cache, before the workers are started: the workers only open the database and read it,
+        since changing the journal mode needs the database to themselves.
+        """
+        conn = self.connect()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        with conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS lines (key BLOB PRIMARY KEY, line TEXT)')
+
+    def connect(self):
+        """The connection of this process (connections can't be shared with forked workers)"""
+        if self.conn is None or self.pid != os.getpid():
+            self.conn = sqlite3.connect(self.path, timeout=600)
+            self.pid = os.getpid()
+        return self.conn
+
+    def key(self, line):
+        return hashlib.sha1(self.digest + line.encode('utf-8')).digest()
+
+    def lookup(self, keys):
+        """
+        Look up the normalized lines of keys. A line that normalization drops is stored as None.
+
+        :param keys:
+        :return: dict from the keys that are in the cache to their lines
+        """
+        conn = self.connect()
+        found = {}
+        for i in range(0, len(keys), LOOKUP_BATCH_SIZE):
+            batch = keys[i:i + LOOKUP_BATCH_SIZE]
+            query = 'SELECT key, line FROM lines WHERE key IN ({})'.format(','.join(['?'] * len(batch)))
+            found.update(conn.execute(query, batch).fetchall())
+        return found
+
+    def add(self, entries):
+        """
+        Store (key, normalized line) pairs.
+
+        :param entries:
+        :return:
+        """
+        if entries:
+            conn = self.connect()
+            with conn:
+                conn.executemany('INSERT OR REPLACE INTO lines (key, line) VALUES (?, ?)', entries)
+
+    def close(self):
+        if self.conn is not None and self.pid == os.getpid():
+            self.conn.close()
+        self.conn = None
@@ -14,11 +14,13 @@
 
     Format of the input corpus (Leipzig Wortschatz): One sentence per line, ending with a full stop.
 
+    NLTK is imported the first time a line is tokenized, and nothing is downloaded: the punkt models have to be
+    installed beforehand (python3 -m nltk.downloader punkt). set_tokenizer('regex') uses a simple regular
+    expression tokenizer instead, which doesn't need NLTK at all.
+
 """
 
 import re
-import nltk
-nltk.download('punkt')
 
 import char_constants
 #from normalization import char_constants
@@ -27,10 +29,50 @@ import char_constants
 LETTERS = '[' + char_constants.LETTERS + ']+'
 WEBPAGE_LOC = 'Þú ert hér:'
 
+# Patterns used for every line are compiled once
+NON_VALID_PATTERN = re.compile(char_constants.NON_VALID_CHARS)
+DASH_PATTERN = re.compile(LETTERS + r'-\s*' + LETTERS)
+E_MAIL_PATTERN = re.compile(r'[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]{2,4}')
+MEIRA_FORSIDA_PATTERN = re.compile(r'(^innlent)?.+(meira forsíða\.\.$)', re.IGNORECASE)
+FORSIDA_PATTERN = re.compile(r'(^innlent)?.+(forsíða\.\.$)', re.IGNORECASE)
+FORSIDA_END_PATTERN = re.compile(r'forsíða\.\.$', re.IGNORECASE)
+# Tokens of the regex tokenizer: words and numbers, also with inner periods, commas, colons and apostrophes
+# ('t.d', '12:46', '3,5'), and any other non-space character on its own
+REGEX_TOKEN_PATTERN = re.compile(r"\w+(?:[.,:']\w+)*|[^\w\s]")
+
+TOKENIZERS = ['nltk', 'regex']
+_word_tokenize = None
+
+
+def set_tokenizer(name='nltk'):
+    """
+    Choose the tokenizer of word_tokenize, and load it (NLTK is imported here, not when this module is imported).
+
+    :param name: 'nltk' for nltk.word_tokenize, or 'regex' for regex_word_tokenize
+    :return:
+    """
+    global _word_tokenize
+    if name == 'nltk':
+        import nltk
+        _word_tokenize = nltk.word_tokenize
+    elif name == 'regex':
+        _word_tokenize = regex_word_tokenize
+    else:
+        raise ValueError('Unknown tokenizer {}, should be one of {}'.format(name, ', '.join(TOKENIZERS)))
+
+
+def word_tokenize(text):
+    if _word_tokenize is None:
+        set_tokenizer('nltk')
+    return _word_tokenize(text)
+
+
+def regex_word_tokenize(text):
+    return REGEX_TOKEN_PATTERN.findall(text)
+
+
 def delete_non_conform_symbols(line):
-    non_valid = re.compile(char_constants.NON_VALID_CHARS)
-    clean_line = re.sub(non_valid, '', line)
-    return clean_line
+    return NON_VALID_PATTERN.sub('', line)
 
 
 def remove_dashes(line):
@@ -41,12 +83,30 @@ def remove_dashes(line):
     processed in a later step if it should be dealt with. Dashes surrounded by spaces are also
     left as is, as they often function as a kind of sentence boundary: 'tröll til sölu - Stóðhestsefni ...'
 
+    Each match is handled in one pass. Because every occurrence of a match was replaced in the line, a dash
+    that is not part of a match can also be replaced ('Suður-Ameríku-ríki Ameríku-ríki'); those lines
+    still have a match after the pass and are handled by remove_dashes_sequential.
+
     :param line:
     :return:
     """
+    if '-' not in line:
+        return line
+
+    replaced = DASH_PATTERN.sub(_replace_dash, line)
+    if '-' in replaced and DASH_PATTERN.search(replaced):
+        return remove_dashes_sequential(line)
+
+    return replaced
+
+
+def _replace_dash(m):
+    return m.group().replace('-', ' ')
+
+
+def remove_dashes_sequential(line):
     replaced = line
-    pattern = re.compile(LETTERS + '-\s*' + LETTERS)
-    for m in re.finditer(pattern, line):
+    for m in DASH_PATTERN.finditer(line):
         substr = m.group()
         repl = substr.replace('-', ' ')
         replaced = replaced.replace(substr, repl)
@@ -60,7 +120,10 @@ def replace_e_mail(line):
     :param line:
     :return: line without e-mail if found, otherwise return line
     """
-    match = re.search('[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]{2,4}', line)
+    if '@' not in line:
+        return line
+
+    match = E_MAIL_PATTERN.search(line)
     if match:
         e_mail = match.group()
         return line.replace(e_mail, '')
@@ -69,7 +132,7 @@ def replace_e_mail(line):
 
 
 def replace_pattern(regex, text):
-    pattern = re.compile(regex, re.IGNORECASE)
+    pattern = re.compile(regex, re.IGNORECASE) if isinstance(regex, str) else regex
 
     m = pattern.match(text)
     res = text
@@ -92,32 +155,46 @@ def clean_web_page_labels(line):
     if it starts with a 'suspicious' label
     """
 
-    if re.search(WEBPAGE_LOC, line):
-        if re.search('(Gestabók)|(Viðburðir)', line):
+    if WEBPAGE_LOC in line:
+        if 'Gestabók' in line or 'Viðburðir' in line:
             return ''
-        tokens = nltk.word_tokenize(line)
+        tokens = word_tokenize(line)
         anchor_ind = tokens.index(':')
         text = ' '.join(tokens[anchor_ind + 4:])
         text = text.replace('án commenta', '')
         return text
 
-    res = replace_pattern('(^innlent)?.+(meira forsíða\.\.$)', line)
-    res = replace_pattern('(^innlent)?.+(forsíða\.\.$)', res)
+    # both patterns only match lines ending with 'forsíða..', which most lines don't
+    if not FORSIDA_END_PATTERN.search(line.rstrip()[-9:]):
+        return line.strip()
+
+    res = replace_pattern(MEIRA_FORSIDA_PATTERN, line)
+    res = replace_pattern(FORSIDA_PATTERN, res)
     return res.strip()
 
 
-def process(line):
+def clean(line):
     """
-    Perform some cleaning procedures: remove all symbols irrelevant for syntax and pronunciation;
-    remove e-mail addresses; remove some web-page specific labels (to avoid bias in word frequency).
+    The cleaning steps of process, without the final tokenization.
 
     :param line:
-    :return: a cleaned version of the input, where also punctuation is separated by spaces
+    :return: the cleaned line
     """
     processed_line = delete_non_conform_symbols(line)
     processed_line = remove_dashes(processed_line)
     processed_line = replace_e_mail(processed_line)
     processed_line = clean_web_page_labels(processed_line)
-    tokens = nltk.word_tokenize(processed_line)
+    return processed_line
+
+
+def process(line):
+    """
+    Perform some cleaning procedures: remove all symbols irrelevant for syntax and pronunciation;
+    remove e-mail addresses; remove some web-page specific labels (to avoid bias in word frequency).
+
+    :param line:
+    :return: a cleaned version of the input, where also punctuation is separated by spaces
+    """
+    tokens = word_tokenize(clean(line))
     result = ' '.join(tokens)
     return result
@@ -0,0 +1,191 @@
+# Description:
+# Shared by the samromur_prep_data.py scripts of the recipes. The lines of the Kaldi data dir files
+# (text, wav.scp, utt2spk, spk2utt, spk2gender) are built for all utterances at once with pandas string
+# operations, and each file is written with a single call. The files are written sorted and unique in
+# LC_ALL=C order, as utils/fix_data_dir.sh would leave them, and validate_data_dir checks them in one
+# pass over each file instead of calling utils/validate_data_dir.sh.
+# load_metadata reads metadata.tsv into a typed DataFrame and keeps a pickled copy of it next to the
+# TSV, which later runs load instead of parsing the TSV again as long as the TSV is unchanged.
+
+import os
+import pickle
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+
+# Bump when the typing of the metadata changes, so that old caches are not used
+METADATA_CACHE_VERSION = 1
+CATEGORICAL_COLUMNS = ["status", "gender", "speaker_id", "age"]
+NUMERIC_COLUMNS = ["marosijo_score", "is_valid", "duration"]
+
+
+def type_metadata(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Make the columns with few distinct values categorical and the scores numeric, with NaN
+    where a score is missing or not a number
+    """
+    for col in CATEGORICAL_COLUMNS:
+        if col in df:
+            df[col] = df[col].astype("category")
+    for col in NUMERIC_COLUMNS:
+        if col in df:
+            df[col] = pd.to_numeric(df[col], errors="coerce")
+    return df
+
+
+def load_metadata(meta_file, dtype=None, cache_file=None) -> pd.DataFrame:
+    """
+    Read the Samromur metadata file with the given read_csv dtype into a typed DataFrame
+    (see type_metadata). The DataFrame is cached in cache_file (default: the metadata file
+    with the suffix .pkl added) and reused while the size and modification time of the
+    metadata file, the dtype and the pandas and numpy versions stay the same. The cache is
+    skipped if it can't be written.
+    """
+    cache_file = cache_file or f"{meta_file}.pkl"
+    stat = os.stat(meta_file)
+    key = (METADATA_CACHE_VERSION, pd.__version__, np.__version__, stat.st_size, stat.st_mtime_ns, repr(dtype))
+    try:
+        with open(cache_file, "rb") as f:
+            cached_key, df = pickle.load(f)
+        if cached_key == key:
+            return df
+    except Exception:
+        # missing, unreadable, or pickled by other versions of pandas or numpy: read the TSV again
+        pass
+
+    df = type_metadata(pd.read_csv(meta_file, sep="\t", dtype=dtype, low_memory=False))
+    tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_file, "wb") as f:
+            pickle.dump((key, df), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+    except OSError as e:
+        print(f"Not caching the metadata in {cache_file}: {e}")
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    return df
+
+
+def select_split(df: pd.DataFrame, status: str, contains: bool = False) -> pd.DataFrame:
+    """
+    The rows of df whose status is status or, with contains, has status in it. The statuses are
+    matched once per category and the rows are selected by their category codes
+    """
+    categories = df["status"].cat.categories
+    wanted = [i for i, c in enumerate(categories) if (status in c if contains else c == status)]
+    return df[np.isin(df["status"].cat.codes.to_numpy(), wanted)]
+
+
+def audio_paths(audio_dir: str, *parts: pd.Series) -> pd.Series:
+    """
+    The same paths as Path(audio_dir).joinpath(*parts) for every row, as strings
+    """
+    root = str(Path(audio_dir))
+    paths = pd.Series("" if root == "." else root.rstrip("/") + "/", index=parts[0].index)
+    for i, part in enumerate(parts):
+        paths = paths + part.astype(str) + ("/" if i < len(parts) - 1 else "")
+    return paths
+
+
+def write_lines(path, lines: pd.Series):
+    with open(path, "w") as f:
+        if len(lines):
+            f.write("\n".join(lines) + "\n")
+
+
+def c_sorted(keys: pd.Series) -> np.ndarray:
+    """
+    Positions of keys in LC_ALL=C order (the code point order of str is the byte order of UTF-8).
+    The sort is stable, so equal keys keep their order
+    """
+    return np.argsort(keys.to_numpy(dtype=object), kind="stable")
+
+
+def write_data_dir(
+    datadir,
+    utt_id: pd.Series,
+    text: pd.Series,
+    wav_path: pd.Series,
+    sample_rate: pd.Series,
+    speaker: pd.Series,
+    gender: pd.Series = None,
+):
+    """
+    Write text, wav.scp, utt2spk, spk2utt and, if gender is given, spk2gender to datadir, sorted by
+    utterance and speaker ID. All series are indexed by utterance. Of repeated utterance IDs and of the
+    genders of a speaker only the first is kept, like utils/fix_data_dir.sh does.
+    """
+    utt_id = utt_id.astype(str)
+    speaker = speaker.astype(str)
+    order = c_sorted(utt_id)
+    order = order[~utt_id.iloc[order].duplicated().to_numpy()]
+    if len(order) < len(utt_id):
+        print(f"Dropped {len(utt_id) - len(order)} utterances with repeated IDs")
+    utt_id, speaker = utt_id.iloc[order], speaker.iloc[order]
+
+    write_lines(f"{datadir}/text", utt_id + " " + text.iloc[order].astype(str))
+    write_lines(
+        f"{datadir}/wav.scp",
+        utt_id
+        + " sox - -c1 -esigned -r "
+        + sample_rate.iloc[order].astype(str)
+        + " -twav - < "
+        + wav_path.iloc[order]
+        + " |",
+    )
+    write_lines(f"{datadir}/utt2spk", utt_id + " " + speaker)
+
+    spk2utt = utt_id.groupby(speaker.to_numpy(), sort=False).agg(" ".join)
+    spk2utt = spk2utt.iloc[c_sorted(spk2utt.index.to_series())]
+    write_lines(f"{datadir}/spk2utt", spk2utt.index + " " + spk2utt)
+
+    if gender is not None:
+        spk2gender = gender.iloc[order].astype(str).groupby(speaker.to_numpy(), sort=False).first()
+        spk2gender = spk2gender.loc[spk2utt.index]
+        write_lines(f"{datadir}/spk2gender", spk2gender.index + " " + spk2gender)
+
+
+def read_sorted(path):
+    """
+    Yield the key and the rest of each line of a data dir file, checking that the keys are sorted
+    and unique
+    """
+    prev = None
+    with open(path) as f:
+        for n, line in enumerate(f, 1):
+            key, _, rest = line.rstrip("\n").partition(" ")
+            if prev is not None and key <= prev:
+                problem = "repeated" if key == prev else "not sorted"
+                raise ValueError(f"{path}:{n}: key {key} is {problem}")
+            prev = key
+            yield key, rest
+
+
+def validate_data_dir(datadir):
+    """
+    Check that the files of datadir are sorted and unique, cover the same utterances, and that spk2utt
+    and spk2gender agree with utt2spk. Raises ValueError on the first problem
+    """
+    utt2spk = list(read_sorted(f"{datadir}/utt2spk"))
+    utts = [utt for utt, _ in utt2spk]
+    for name in ["text", "wav.scp"]:
+        if [utt for utt, _ in read_sorted(f"{datadir}/{name}")] != utts:
+            raise ValueError(f"{datadir}/{name} and {datadir}/utt2spk have different utterances")
+
+    # With utt2spk sorted, the utterances of each speaker must be contiguous and the speakers sorted,
+    # so listing spk2utt in order gives utt2spk back
+    i = 0
+    speakers = []
+    for spk, spk_utts in read_sorted(f"{datadir}/spk2utt"):
+        for utt in spk_utts.split():
+            if i >= len(utt2spk) or utt2spk[i] != (utt, spk):
+                raise ValueError(f"{datadir}/spk2utt does not agree with the order of {datadir}/utt2spk at {spk} {utt}")
+            i += 1
+        speakers.append(spk)
+    if i != len(utt2spk):
+        raise ValueError(f"{datadir}/spk2utt is missing utterances of {datadir}/utt2spk")
+
+    if Path(f"{datadir}/spk2gender").is_file():
+        if [spk for spk, _ in read_sorted(f"{datadir}/spk2gender")] != speakers:
+            raise ValueError(f"{datadir}/spk2gender and {datadir}/spk2utt have different speakers")
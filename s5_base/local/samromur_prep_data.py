@@ -5,10 +5,13 @@
 # This script will output the files text, wav.scp, utt2spk, spk2utt and spk2gender
 # to data/train, data/dev data/test with test/train/dev splits defined in the metadatafile.
 
-import subprocess
+import os
+import sys
 import argparse
 from pathlib import Path
-import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "preprocessing"))
+from samromur_data import audio_paths, write_data_dir, validate_data_dir, load_metadata, select_split
 
 
 def parse_arguments():
@@ -28,6 +31,12 @@ def parse_arguments():
     parser.add_argument(
         "output_dir", type=str, help="Where to place the created files",
     )
+    parser.add_argument(
+        "--meta_cache",
+        type=str,
+        default=None,
+        help="Where to cache the parsed metadata file (default: the metadata file with .pkl added)",
+    )
     return parser.parse_args()
 
 
@@ -45,39 +54,20 @@ def dir_path(path: str):
         raise argparse.ArgumentTypeError(f"Directory:{path} is not a valid directory")
 
 
-def append_to_file(df, audio_dir: str, text, wavscp, utt2spk, spk2gender):
+def write_files(df, audio_dir: str, datadir):
     """
-    Append relevant data to the files
+    Write the data dir files of the utterances in df
     """
-    for i in df.index:
-        utt_id = f"{df.at[i, 'speaker_id']}-{i}"
-        text.write(f"{utt_id} {df.at[i, 'sentence_norm']}\n")
-
-        # Handle folder structure for test-dev-train/padded_speaker_id/file
-        # Ex: test/000037/000037-0001844.flac
-        status = df.at[i, "status"]
-        speaker_id = str(df.at[i, "speaker_id"]).zfill(6)
-        filename = df.at[i, "filename"]
-        path = Path(audio_dir).joinpath(status, speaker_id, filename)
-
-        wavscp.write(
-            f"{utt_id} sox - -c1 -esigned -r {df.at[i, 'sample_rate']} -twav - < {path} |\n"
-        )
-        utt2spk.write(f"{utt_id} {df.at[i, 'speaker_id']}\n")
-
-        # This line will cause in error in versions of Samrómur where the speaker is unknown
-        spk2gender.write(f"{df.at[i, 'speaker_id']} {df.at[i, 'gender'][0]}\n")
-
-
-def clean_dir(datadir):
-    subprocess.call(
-        f"utils/utt2spk_to_spk2utt.pl < {datadir}/utt2spk > {datadir}/spk2utt",
-        shell=True,
-    )
-    subprocess.call(
-        f"utils/validate_data_dir.sh --no-feats {datadir} || utils/fix_data_dir.sh {datadir}",
-        shell=True,
-    )
+    utt_id = df["speaker_id"].astype(str) + "-" + df.index.astype(str).to_series(index=df.index)
+
+    # Handle folder structure for test-dev-train/padded_speaker_id/file
+    # Ex: test/000037/000037-0001844.flac
+    path = audio_paths(audio_dir, df["status"], df["speaker_id"].astype(str).str.zfill(6), df["filename"])
+
+    # This will cause in error in versions of Samrómur where the speaker is unknown
+    gender = df["gender"].str[0]
+
+    write_data_dir(datadir, utt_id, df["sentence_norm"], path, df["sample_rate"], df["speaker_id"], gender)
 
 
 def main():
@@ -89,13 +79,7 @@ def main():
     outdir = args.output_dir
     Path(outdir).mkdir(parents=True, exist_ok=True)
 
-    # dtype fixes low mixed types warning
-    df = pd.read_csv(
-        metadata,
-        sep="\t",
-        index_col="id",
-        dtype={"is_valid": object, "age": object, "marosijo_score": object},
-    )
+    df = load_metadata(metadata, cache_file=args.meta_cache).set_index("id")
 
     for data_file in ["train", "dev", "eval"]:
         datadir = Path(outdir).joinpath(data_file)
@@ -103,26 +87,12 @@ def main():
 
         print(f"\nCreating files in {datadir}")
 
-        with open(f"{datadir}/text", "w") as text, open(
-            f"{datadir}/wav.scp", "w"
-        ) as wav, open(f"{datadir}/utt2spk", "w") as utt2spk, open(
-            f"{datadir}/spk2gender", "w"
-        ) as spk2gender:
-
-            if data_file == "train":
-                # Create new dataframes with only lines containing the current status
-                df_part = df[df["status"].str.contains("train")]
-                append_to_file(df_part, audio_dir, text, wav, utt2spk, spk2gender)
-
-            if data_file == "dev":
-                df_part = df[df["status"].str.contains("dev")]
-                append_to_file(df_part, audio_dir, text, wav, utt2spk, spk2gender)
-
-            if data_file == "eval":
-                df_part = df[df["status"].str.contains("test")]
-                append_to_file(df_part, audio_dir, text, wav, utt2spk, spk2gender)
+        # Create new dataframes with only lines containing the current status
+        status = {"train": "train", "dev": "dev", "eval": "test"}[data_file]
+        df_part = select_split(df, status, contains=True)
+        write_files(df_part, audio_dir, datadir)
 
-        clean_dir(datadir)
+        validate_data_dir(datadir)
 
 
 if __name__ == "__main__":
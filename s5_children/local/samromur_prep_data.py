@@ -5,10 +5,13 @@
 # This script will output the files text, wav.scp, utt2spk and spk2utt
 # to data/train, data/eval data/test with test/train/eval splits defined in the metadatafile.
 
-import subprocess
+import os
+import sys
 import argparse
 from pathlib import Path
-import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "preprocessing"))
+from samromur_data import audio_paths, write_data_dir, validate_data_dir, load_metadata, select_split
 
 
 def parse_arguments():
@@ -28,6 +31,12 @@ def parse_arguments():
     parser.add_argument(
         "output_dir", type=str, help="Where to place the created files",
     )
+    parser.add_argument(
+        "--meta_cache",
+        type=str,
+        default=None,
+        help="Where to cache the parsed metadata file (default: the metadata file with .pkl added)",
+    )
     return parser.parse_args()
 
 
@@ -45,28 +54,13 @@ def dir_path(path: str):
         raise argparse.ArgumentTypeError(f"Directory:{path} is not a valid directory")
 
 
-def append_to_file(df, audio_dir: str, text, wavscp, utt2spk):
+def write_files(df, audio_dir: str, datadir):
     """
-    Append relevant data to the files
+    Write the data dir files of the utterances in df
     """
-    for i in df.index:
-        utt_id = f"{df.at[i, 'speaker_id']}-{i}"
-        text.write(f"{utt_id} {df.at[i, 'sentence_norm']}\n")
-        wavscp.write(
-            f"{utt_id} sox - -c1 -esigned -r {df.at[i, 'sample_rate']} -twav - < {Path(audio_dir).joinpath(df.at[i, 'filename'])} |\n"
-        )
-        utt2spk.write(f"{utt_id} {df.at[i, 'speaker_id']}\n")
-
-
-def clean_dir(datadir):
-    subprocess.call(
-        f"utils/utt2spk_to_spk2utt.pl < {datadir}/utt2spk > {datadir}/spk2utt",
-        shell=True,
-    )
-    subprocess.call(
-        f"utils/validate_data_dir.sh --no-feats {datadir} || utils/fix_data_dir.sh {datadir}",
-        shell=True,
-    )
+    utt_id = df["speaker_id"].astype(str) + "-" + df.index.astype(str).to_series(index=df.index)
+    path = audio_paths(audio_dir, df["filename"])
+    write_data_dir(datadir, utt_id, df["sentence_norm"], path, df["sample_rate"], df["speaker_id"])
 
 
 def main():
@@ -78,7 +72,7 @@ def main():
     outdir = args.output_dir
     Path(outdir).mkdir(parents=True, exist_ok=True)
 
-    df = pd.read_csv(metadata, sep="\t", index_col="id")
+    df = load_metadata(metadata, cache_file=args.meta_cache).set_index("id")
 
     for data_file in ["train", "dev", "eval"]:
         datadir = Path(outdir).joinpath(data_file)
@@ -86,24 +80,11 @@ def main():
 
         print(f"\nCreating files in {datadir}")
 
-        with open(f"{datadir}/text", "w") as text, open(
-            f"{datadir}/wav.scp", "w"
-        ) as wav, open(f"{datadir}/utt2spk", "w") as utt2spk:
-
-            if data_file == "train":
-                # Create new dataframes with only lines containing the current status
-                df_part = df[df["status"].str.contains("train")]
-                append_to_file(df_part, audio_dir, text, wav, utt2spk)
-
-            if data_file == "dev":
-                df_part = df[df["status"].str.contains("dev")]
-                append_to_file(df_part, audio_dir, text, wav, utt2spk)
-
-            if data_file == "eval":
-                df_part = df[df["status"].str.contains("eval")]
-                append_to_file(df_part, audio_dir, text, wav, utt2spk)
+        # Create new dataframes with only lines containing the current status
+        df_part = select_split(df, data_file, contains=True)
+        write_files(df_part, audio_dir, datadir)
 
-        clean_dir(datadir)
+        validate_data_dir(datadir)
 
 
 if __name__ == "__main__":
@@ -4,11 +4,15 @@
 # Description:
 # This script will output the files text, wav.scp, utt2spk, spk2utt and spk2gender
 
-import subprocess
+import os
+import sys
 import argparse
 from pathlib import Path
 import pandas as pd
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "preprocessing"))
+from samromur_data import audio_paths, write_data_dir, validate_data_dir, load_metadata, select_split
+
 def parse_arguments():
     parser = argparse.ArgumentParser(
         description="""This script will output the files text, wav.scp, utt2spk, spk2utt and spk2gender
@@ -20,6 +24,8 @@ def parse_arguments():
     parser.add_argument("-a", "--audio_dir", type=dir_path, help="The Samrór root directory", )
     parser.add_argument("-m", "--meta_file", type=file_path, help="The Samrómur metadata file. ")
     parser.add_argument("-o", "--output_dir", type=str, default='', help="Where to place the created files", )
+    parser.add_argument("--meta_cache", type=str, default=None,
+                        help="Where to cache the parsed metadata file (default: the metadata file with .pkl added)")
     return parser.parse_args()
 
 def file_path(path: str):
@@ -36,29 +42,16 @@ def dir_path(path: str):
         raise argparse.ArgumentTypeError(f"Directory:{path} is not a valid directory")
 
 
-def append_to_file(df:pd.DataFrame, audio_dir:str, text, wavscp, utt2spk, spk2gender):
+def write_files(df:pd.DataFrame, audio_dir:str, datadir):
     """
-    Append relevant data to the files
+    Write the data dir files of the utterances in df
     """
-    # NOTE! If we use something else that a counter in the ID, e.g. the recording ID,
-    # we could skip the loop and just used vectorized operations
-    for i in df.index:
-        utt_id = df.at[i, 'filename'].replace('.flac', '')
-        text.write(f"{utt_id} {df.at[i, 'sentence_norm']}\n")
-        wavscp.write(f"{utt_id} sox - -c1 -esigned -r {df.at[i, 'sample_rate']} -twav - < {Path(audio_dir).joinpath(df.at[i, 'status'], df.at[i, 'speaker_id'], df.at[i, 'filename'])} |\n")
-        utt2spk.write(f"{utt_id} {df.at[i, 'speaker_id']}\n")
-
-        if df.at[i, 'gender'] == 'male': g = "m"
-        elif df.at[i, 'gender'] == 'female': g = "f"
-        else: g = "f" 
-        spk2gender.write(f"{df.at[i, 'speaker_id']} {g}\n")
-
-
-def clean_dir(datadir):
-    subprocess.call(f"utils/utt2spk_to_spk2utt.pl < {datadir}/utt2spk > {datadir}/spk2utt",
-        shell=True)
-    subprocess.call(f"utils/validate_data_dir.sh --no-feats {datadir} || utils/fix_data_dir.sh {datadir}",
-        shell=True)
+    # The recording ID is the utterance ID, so everything is done with vectorized operations
+    utt_id = df['filename'].str.replace('.flac', '', regex=False)
+    path = audio_paths(audio_dir, df['status'], df['speaker_id'], df['filename'])
+    # Speakers of unknown gender are marked as female
+    gender = (df['gender'] == 'male').map({True: "m", False: "f"})
+    write_data_dir(datadir, utt_id, df['sentence_norm'], path, df['sample_rate'], df['speaker_id'], gender)
 
 
 def main():
@@ -70,7 +63,7 @@ def main():
     outdir = args.output_dir
     Path(outdir).mkdir(parents=True, exist_ok=True)
 
-    df = pd.read_csv(metadata, sep="\t", dtype="str")
+    df = load_metadata(metadata, dtype="str", cache_file=args.meta_cache)
     df = df.sort_values(by=['speaker_id', 'id'], ascending=True)
     df.set_index('id', inplace=True)
 
@@ -80,15 +73,10 @@ def main():
 
         print(f"\nCreating files in {datadir}")
 
-        with open(f"{datadir}/text", "w") as text, \
-             open(f"{datadir}/wav.scp", "w" ) as wav, \
-             open(f"{datadir}/utt2spk", "w") as utt2spk, \
-             open(f"{datadir}/spk2gender", "w") as spk2gender:
-
-            df_subset = df[df["status"] == data_file]
-            append_to_file(df_subset, audio_dir, text, wav, utt2spk, spk2gender)
+        df_subset = select_split(df, data_file)
+        write_files(df_subset, audio_dir, datadir)
 
-        clean_dir(datadir)
+        validate_data_dir(datadir)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+# Boundary marker formatting shared by the subword tokenizers.
+# The boundary marker styles, for the words "word like" split into "wo rd" and "li ke":
+#   r:  wo+ rd li+ ke
+#   l:  wo +rd li +ke
+#   lr: wo+ +rd li+ +ke
+#   wb: wo rd + li ke
+
+import sys
+
+SP_SPACE = '▁'
+
+# (suffix of a non-final unit, prefix of a non-initial unit) within a word
+UNIT_MARKERS = {
+    'r': ('{0}', ''),
+    'l': ('', '{0}'),
+    'lr': ('{0}', '{0}'),
+}
+
+# What apply_sp.py has always replaced ' ▁' (the start of a word-internal piece) with.
+# Note that 'l' gives the same output as 'r' there.
+SP_MARKERS = {
+    'r': '{0} ',
+    'l': '{0} ',
+    'lr': '{0} {0}',
+}
+
+
+def format_words(words, separator='+', bm='r'):
+    """Join words, each a sequence of subword units, into one line with the boundary marker style bm"""
+    if bm == 'wb':
+        return f' {separator} '.join([' '.join(units) for units in words])
+    suffix, prefix = UNIT_MARKERS[bm]
+    suffix = suffix.format(separator)
+    prefix = prefix.format(separator)
+    out = []
+    for units in words:
+        last = len(units) - 1
+        for i, unit in enumerate(units):
+            out.append((prefix if i else '') + unit + (suffix if i < last else ''))
+    return ' '.join(out)
+
+
+def format_sp_pieces(pieces, separator='+', bm='lr'):
+    """Convert a list of SentencePiece pieces to a line with the boundary marker style bm in one pass.
+
+    The output is the same as the older apply_sp.py, which built the line with ' ▁' in front of
+    word-internal pieces and then replaced those: lines start with a space, except for 'wb'.
+    """
+    n = len(pieces)
+    out = [''] * n
+
+    if bm == 'wb':
+        marker = f' {separator} '
+        for i, tok in enumerate(pieces):
+            if tok[:1] == SP_SPACE:
+                out[i] = (marker if i else '') + tok[1:]
+            else:
+                out[i] = (' ' if i else '') + tok
+        return ''.join(out)
+
+    marker = SP_MARKERS[bm].format(separator) if bm in SP_MARKERS else ' ' + SP_SPACE
+    i = 0
+    while i < n:
+        tok = pieces[i]
+        if tok == SP_SPACE:
+            # The next piece is a whole word
+            if i + 1 == n:
+                break
+            unit = pieces[i+1]
+            i += 1
+        elif tok[0] == SP_SPACE:
+            # The word starts with this piece
+            unit = tok[1:]
+        elif SP_SPACE not in tok:
+            # A word-internal piece
+            unit = SP_SPACE + tok
+        else:
+            sys.exit('Error in apply_sp_bpe.py this should not be here\n'+ tok)
+
+        if unit[:1] == SP_SPACE:
+            out[i] = marker + unit[1:]
+        else:
+            out[i] = ' ' + unit
+        i += 1
+
+    return ''.join(out)
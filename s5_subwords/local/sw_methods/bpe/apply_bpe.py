@@ -14,19 +14,312 @@ Proceedings of the 54th Annual Meeting of the Association for Computational Ling
 
 from __future__ import unicode_literals, division
 
+import os
 import sys
+import fcntl
+import glob
+import pickle
+import mmap
 import codecs
 import io
 import argparse
+import hashlib
+import heapq
 import re
+import struct
+import zlib
+from array import array
+from collections import OrderedDict
+from itertools import islice
+from multiprocessing import Pool
 
 # hack for python2/3 compatibility
 from io import open
 argparse.open = open
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from boundary_markers import format_words
+
+class SegmentationCache(object):
+    """Cache of word segmentations that holds at most max_size entries, evicting the least recently used ones.
+
+    If path is given, words that are not in memory are looked up in a sorted table at that path, which is
+    memory-mapped. New segmentations are logged to a file next to the table, and save() merges them into it.
+    The logs are named after run_id (the pid of the process that calls save()) and the pid of the writing
+    process, so that save() only merges the logs of its own run, not those of other runs sharing the table.
+    """
+
+    MAGIC = b'BPECACH1'
+
+    def __init__(self, max_size=None, path=None, run_id=None):
+        self.max_size = max_size if max_size and max_size > 0 else None
+        self.path = path
+        self.run_id = run_id if run_id is not None else os.getpid()
+        self.entries = OrderedDict()
+        self.table = None
+        self.log = None
+        if path is not None and os.path.exists(path):
+            self._open_table()
+
+    def _open_table(self):
+        with open(self.path, 'rb') as fobj:
+            self.table = mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.table[:8] != self.MAGIC:
+            raise ValueError('{0} is not a segmentation cache file'.format(self.path))
+        size = struct.unpack('<Q', self.table[8:16])[0]
+        self.offsets = memoryview(self.table)[16:16 + 8 * (size + 1)].cast('Q')
+        self.data_start = 16 + 8 * (size + 1)
+
+    def _table_entry(self, i):
+        record = self.table[self.data_start + self.offsets[i]:self.data_start + self.offsets[i+1]]
+        word, segments = record.split(b'\x00', 1)
+        return word, segments
+
+    def _lookup(self, word):
+        """Binary search for word in the on-disk table"""
+        key = word.encode('utf-8')
+        lo, hi = 0, len(self.offsets) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            entry, segments = self._table_entry(mid)
+            if entry < key:
+                lo = mid + 1
+            elif entry > key:
+                hi = mid
+            else:
+                return tuple(segments.decode('utf-8').split(' '))
+        return None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, word):
+        if word in self.entries:
+            return True
+        if self.table is not None:
+            segments = self._lookup(word)
+            if segments is not None:
+                self._store(word, segments)
+                return True
+        return False
+
+    def __getitem__(self, word):
+        segments = self.entries[word]
+        if self.max_size is not None:
+            self.entries.move_to_end(word)
+        return segments
+
+    def __setitem__(self, word, segments):
+        self._store(word, segments)
+        if self.path is not None:
+            if self.log is None:
+                self.log = open('{0}.{1}.{2}.new'.format(self.path, self.run_id, os.getpid()), 'a', encoding='utf-8')
+            self.log.write('{0}\x00{1}\n'.format(word, ' '.join(segments)))
+
+    def flush(self):
+        if self.log is not None:
+            self.log.flush()
+
+    def _store(self, word, segments):
+        self.entries[word] = segments
+        if self.max_size is not None:
+            self.entries.move_to_end(word)
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def save(self):
+        """Merge the segmentations logged in this run (by this process and its workers) into the on-disk table.
+        The table is re-read and replaced under a lock, so that runs sharing it don't lose each other's entries."""
+        if self.path is None:
+            return
+        if self.log is not None:
+            self.log.close()
+            self.log = None
+        logs = glob.glob('{0}.{1}.*.new'.format(glob.escape(self.path), self.run_id))
+        if not logs:
+            return
+
+        with open(self.path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # another run may have replaced the table since it was opened
+            self.close()
+            entries = {}
+            if os.path.exists(self.path):
+                self._open_table()
+                for i in range(len(self.offsets) - 1):
+                    word, segments = self._table_entry(i)
+                    entries[word] = segments
+            for log in logs:
+                with open(log, encoding='utf-8') as fobj:
+                    for line in fobj:
+                        # a worker that died while writing can leave an incomplete last record
+                        if not line.endswith('\n') or '\x00' not in line:
+                            continue
+                        word, segments = line[:-1].split('\x00', 1)
+                        entries[word.encode('utf-8')] = segments.encode('utf-8')
+
+            offsets = array('Q', [0])
+            with open(self.path + '.tmp', 'wb') as fobj:
+                fobj.write(self.MAGIC)
+                fobj.write(struct.pack('<Q', len(entries)))
+                fobj.write(b'\x00' * 8 * (len(entries) + 1))
+                for word in sorted(entries):
+                    record = word + b'\x00' + entries[word]
+                    fobj.write(record)
+                    offsets.append(offsets[-1] + len(record))
+                fobj.seek(16)
+                fobj.write(struct.pack('<{0}Q'.format(len(offsets)), *offsets))
+
+            self.close()
+            os.replace(self.path + '.tmp', self.path)
+            for log in logs:
+                os.remove(log)
+            self._open_table()
+
+    def close(self):
+        if self.table is not None:
+            self.offsets.release()
+            self.table.close()
+            self.table = None
+
+
+class CompiledCodes(object):
+    """Read-only mapping backed by a hash table in a compiled codes file (see write_compiled_codes).
+
+    With reverse=False it maps pairs of symbols to their rank, like BPE.bpe_codes; with reverse=True
+    it maps merged symbols to the pair they were merged from, like BPE.bpe_codes_reverse.
+    Lookups are memoized per process; the table itself stays in the (shared) memory-mapped file.
+    """
+
+    def __init__(self, buf, records, pool_start, table, reverse=False):
+        self.buf = buf
+        self.records = records
+        self.pool_start = pool_start
+        self.table = table
+        self.mask = len(table) - 1
+        self.reverse = reverse
+        self.memo = {}
+
+    def _record(self, rank):
+        return self.buf[self.pool_start + self.records[rank]:self.pool_start + self.records[rank+1]]
+
+    def _find(self, key):
+        if self.reverse:
+            key_bytes = key.encode('utf-8')
+        else:
+            key_bytes = (key[0] + ' ' + key[1]).encode('utf-8')
+        slot = zlib.crc32(key_bytes) & self.mask
+        while True:
+            rank = self.table[slot]
+            if rank < 0:
+                return None
+            record = self._record(rank)
+            if (record.replace(b' ', b'') if self.reverse else record) == key_bytes:
+                return tuple(record.decode('utf-8').split(' ')) if self.reverse else rank
+            slot = (slot + 1) & self.mask
+
+    def get(self, key, default=None):
+        try:
+            value = self.memo[key]
+        except KeyError:
+            value = self.memo[key] = self._find(key)
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        return sum(1 for rank in self.table if rank >= 0)
+
+    def __iter__(self):
+        for rank in self.table:
+            if rank >= 0:
+                record = self._record(rank).decode('utf-8')
+                yield record.replace(' ', '') if self.reverse else tuple(record.split(' '))
+
+
+def _hash_table(keys, ranks):
+    """Open addressing (linear probing) table of ranks, indexed by crc32 of the key"""
+    size = 1
+    while size < 2 * len(keys):
+        size *= 2
+    table = array('q', [-1]) * size
+    for key, rank in zip(keys, ranks):
+        slot = zlib.crc32(key) & (size - 1)
+        while table[slot] >= 0:
+            slot = (slot + 1) & (size - 1)
+        table[slot] = rank
+    return table
+
+
+COMPILED_MAGIC = b'BPECODE1'
+
+def write_compiled_codes(bpe, path):
+    """Write the codes, ranks and reverse map of bpe to a binary file that BPE.from_compiled memory-maps.
+
+    Layout (little-endian): magic, version (2 x uint32), codes digest (40 bytes), number of records,
+    pair table size, reverse table size (uint64 each), record offsets, pair table, reverse table (int64 ranks,
+    -1 for empty slots) and the records: the pair of rank r as 'first second' in UTF-8.
+    """
+    num_records = max(bpe.bpe_codes.values()) + 1 if bpe.bpe_codes else 0
+    records = [b''] * num_records
+    for pair, rank in bpe.bpe_codes.items():
+        records[rank] = (pair[0] + ' ' + pair[1]).encode('utf-8')
+
+    pairs = list(bpe.bpe_codes.items())
+    pair_table = _hash_table([records[rank] for _, rank in pairs], [rank for _, rank in pairs])
+    merged = list(bpe.bpe_codes_reverse.items())
+    reverse_table = _hash_table([symbol.encode('utf-8') for symbol, _ in merged],
+                                [bpe.bpe_codes[pair] for _, pair in merged])
+
+    offsets = array('Q', [0])
+    for record in records:
+        offsets.append(offsets[-1] + len(record))
+
+    with open(path + '.tmp', 'wb') as fobj:
+        fobj.write(COMPILED_MAGIC)
+        fobj.write(struct.pack('<II', *bpe.version))
+        fobj.write(bpe.codes_digest.encode('ascii'))
+        fobj.write(struct.pack('<QQQ', num_records, len(pair_table), len(reverse_table)))
+        fobj.write(offsets.tobytes())
+        fobj.write(pair_table.tobytes())
+        fobj.write(reverse_table.tobytes())
+        for record in records:
+            fobj.write(record)
+    os.replace(path + '.tmp', path)
+
+def read_compiled_codes(path):
+    """Memory-map a file written by write_compiled_codes, and return version, digest, codes and reverse codes"""
+    with open(path, 'rb') as fobj:
+        buf = mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ)
+    if buf[:8] != COMPILED_MAGIC:
+        raise ValueError('{0} is not a compiled BPE codes file'.format(path))
+    version = struct.unpack('<II', buf[8:16])
+    digest = buf[16:56].decode('ascii')
+    num_records, pair_size, reverse_size = struct.unpack('<QQQ', buf[56:80])
+    view = memoryview(buf)
+    start = 80
+    records = view[start:start + 8 * (num_records + 1)].cast('Q')
+    start += 8 * (num_records + 1)
+    pair_table = view[start:start + 8 * pair_size].cast('q')
+    start += 8 * pair_size
+    reverse_table = view[start:start + 8 * reverse_size].cast('q')
+    start += 8 * reverse_size
+    bpe_codes = CompiledCodes(buf, records, start, pair_table)
+    bpe_codes_reverse = CompiledCodes(buf, records, start, reverse_table, reverse=True)
+    return version, digest, bpe_codes, bpe_codes_reverse
+
+
 class BPE(object):
 
-    def __init__(self, codes, merges=-1, separator='@@', vocab=None, glossaries=None):
+    def __init__(self, codes, merges=-1, separator='@@', vocab=None, glossaries=None, encoder='heap',
+                 cache_size=None, cache_dir=None, split_table=None, boundary_marker='r'):
 
         codes.seek(0)
 
@@ -51,17 +344,68 @@ class BPE(object):
 
         self.bpe_codes_reverse = dict([(pair[0] + pair[1], pair) for pair,i in self.bpe_codes.items()])
 
+        digest = hashlib.sha1()
+        for item in [self.version, sorted(self.bpe_codes.items(), key=lambda x: x[1])]:
+            digest.update(repr(item).encode('utf-8'))
+        self.codes_digest = digest.hexdigest()
+
+        self._setup(separator, vocab, glossaries, encoder, cache_size, cache_dir, split_table, boundary_marker)
+
+    @classmethod
+    def from_compiled(cls, path, separator='@@', vocab=None, glossaries=None, encoder='heap',
+                      cache_size=None, cache_dir=None, split_table=None, boundary_marker='r'):
+        """Create a BPE from a compiled codes file (see write_compiled_codes), without parsing the codes.
+        The tables are memory-mapped, so processes loading the same file share one copy."""
+        bpe = cls.__new__(cls)
+        bpe.version, bpe.codes_digest, bpe.bpe_codes, bpe.bpe_codes_reverse = read_compiled_codes(path)
+        bpe._setup(separator, vocab, glossaries, encoder, cache_size, cache_dir, split_table, boundary_marker)
+        return bpe
+
+    def _setup(self, separator, vocab, glossaries, encoder, cache_size, cache_dir, split_table, boundary_marker):
+
         self.separator = separator
 
+        self.boundary_marker = boundary_marker
+
         self.vocab = vocab
 
         self.glossaries = glossaries if glossaries else []
 
-        self.cache = {}
+        self.glossary_matcher = GlossaryMatcher(self.glossaries)
+
+        self.merge = ENCODERS[encoder]
+
+        sorted_vocab = sorted(vocab) if vocab else None
+
+        # segmentations only depend on the codes and these settings, so they can be shared between runs
+        key = hashlib.sha1()
+        for item in [self.codes_digest, separator, sorted_vocab, self.glossaries]:
+            key.update(repr(item).encode('utf-8'))
+        self.cache_key = key.hexdigest()
+
+        # splits of OOV symbols are computed once for all merged symbols, optionally stored at split_table
+        self.split_table = None
+        if vocab:
+            key = hashlib.sha1()
+            for item in [self.codes_digest, separator, sorted_vocab]:
+                key.update(repr(item).encode('utf-8'))
+            self.split_table = load_split_table(split_table, key.hexdigest()) if split_table else None
+            if self.split_table is None:
+                self.split_table = build_split_table(self.bpe_codes_reverse, vocab, separator)
+                if split_table:
+                    save_split_table(split_table, key.hexdigest(), self.split_table)
+
+        cache_path = os.path.join(cache_dir, self.cache_key + '.bpecache') if cache_dir else None
+        self.cache = SegmentationCache(cache_size, cache_path)
 
     def process_line(self, line):
         """segment line, dealing with leading and trailing whitespace"""
 
+        # the other marker styles end every line with a single newline, like change_boundary_marking_style.py did
+        if self.boundary_marker != 'r':
+            line = line.rstrip()
+            return line[:len(line)-len(line.lstrip())] + self.segment(line) + '\n'
+
         out = ""
 
         leading_whitespace = len(line)-len(line.lstrip())
@@ -79,6 +423,7 @@ class BPE(object):
     def segment(self, sentence):
         """segment single sentence (whitespace-tokenized string) with BPE encoding"""
         output = []
+        words = []
         for word in sentence.strip().split(' '):
             # eliminate double spaces
             if not word:
@@ -91,20 +436,82 @@ class BPE(object):
                                           self.separator,
                                           self.version,
                                           self.cache,
-                                          self.glossaries)]
+                                          self.glossary_matcher.glossary_set,
+                                          self.merge,
+                                          self.split_table)]
+
+            if self.boundary_marker != 'r':
+                words.append(new_word)
+                continue
 
             for item in new_word[:-1]:
                 output.append(item + self.separator)
             output.append(new_word[-1])
 
+        if self.boundary_marker != 'r':
+            return format_words(words, self.separator, self.boundary_marker)
+
         return ' '.join(output)
 
     def _isolate_glossaries(self, word):
-        word_segments = [word]
-        for gloss in self.glossaries:
-            word_segments = [out_segments for segment in word_segments
-                                 for out_segments in isolate_glossary(segment, gloss)]
-        return word_segments
+        return self.glossary_matcher.isolate(word)
+
+
+def trie_pattern(strings):
+    """A regex matching the same strings as the alternation of strings, with common prefixes factored out.
+    Longer matches are tried first, so at a given position it matches the longest of strings that starts there."""
+    trie = {}
+    for string in strings:
+        node = trie
+        for char in string:
+            node = node.setdefault(char, {})
+        node[''] = {}
+
+    def pattern(node):
+        branches = [re.escape(char) + pattern(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        alternation = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        # a string ending here is the shortest match, tried after all longer ones
+        return '(?:' + alternation + ')?' if '' in node else alternation
+
+    return pattern(trie)
+
+
+class GlossaryMatcher(object):
+    """Isolate glossaries in words with one precompiled alternation of all glossaries.
+
+    The result is the same as applying isolate_glossary for every glossary in turn (see isolate_glossaries),
+    where a later glossary can still split a segment isolated by an earlier one. Most words contain no
+    glossary, which one regex search finds out. For the others, one scan with an overlapping lookahead finds
+    the longest glossary starting at each position of the word; the other glossaries starting there are its
+    prefixes, which are listed once per glossary. Only the glossaries found are applied, in their original order.
+    The alternation is factored into a trie (see trie_pattern), so trying it at a position costs at most one
+    branch per character instead of one per glossary.
+    """
+
+    def __init__(self, glossaries):
+        self.glossaries = list(glossaries)
+        self.glossary_set = glossary_set = set(self.glossaries)
+        self.order = {}
+        for i, glossary in enumerate(self.glossaries):
+            self.order.setdefault(glossary, i)
+        self.prefixes = dict((glossary, [glossary[:k] for k in range(1, len(glossary) + 1) if glossary[:k] in glossary_set])
+                             for glossary in glossary_set)
+        if self.glossaries:
+            alternation = trie_pattern(glossary_set)
+            self.regex = re.compile(alternation)
+            self.overlapping_regex = re.compile('(?=(' + alternation + '))')
+        else:
+            self.regex = None
+
+    def isolate(self, word):
+        if self.regex is None or not self.regex.search(word):
+            return [word]
+        found = set()
+        for match in self.overlapping_regex.finditer(word):
+            found.update(self.prefixes[match.group(1)])
+        return isolate_glossaries(word, sorted(found, key=self.order.get))
 
 def create_parser():
     parser = argparse.ArgumentParser(
@@ -115,10 +522,16 @@ def create_parser():
         '--input', '-i', type=argparse.FileType('r'), default=sys.stdin,
         metavar='PATH',
         help="Input file (default: standard input).")
-    parser.add_argument(
+    codes = parser.add_mutually_exclusive_group(required=True)
+    codes.add_argument(
         '--codes', '-c', type=argparse.FileType('r'), metavar='PATH',
-        required=True,
         help="File with BPE codes (created by learn_bpe.py).")
+    codes.add_argument(
+        '--compiled-codes', type=str, metavar='PATH',
+        help="Compiled BPE codes (created with --compile). Loads without parsing, and is shared between workers.")
+    parser.add_argument(
+        '--compile', type=str, default=None, metavar='PATH',
+        help="Compile the codes given with --codes (and --merges) to a binary file, and exit.")
     parser.add_argument(
         '--merges', '-m', type=int, default=-1,
         metavar='INT',
@@ -131,6 +544,10 @@ def create_parser():
     parser.add_argument(
         '--separator', '-s', type=str, default='@@', metavar='STR',
         help="Separator between non-final subword units (default: '%(default)s'))")
+    parser.add_argument(
+        '--boundary-marker', '-bm', type=str, default='r', choices=['r', 'l', 'lr', 'wb'],
+        help="Boundary marker style: the separator after non-final units (r), before non-initial units (l), "+
+             "on both sides (lr) or as a token between words (wb) (default: '%(default)s')")
     parser.add_argument(
         '--vocabulary', type=argparse.FileType('r'), default=None,
         metavar="PATH",
@@ -139,11 +556,37 @@ def create_parser():
         '--vocabulary-threshold', type=int, default=None,
         metavar="INT",
         help="Vocabulary threshold. If vocabulary is provided, any word with frequency < threshold will be treated as OOV")
+    parser.add_argument(
+        '--split-table', type=str, default=None,
+        metavar="PATH",
+        help="File for the precomputed in-vocabulary splits of all merged symbols (with --vocabulary). "+
+             "It is loaded if it matches the codes and vocabulary, and (re)built otherwise")
     parser.add_argument(
         '--glossaries', type=str, nargs='+', default=None,
         metavar="STR",
         help="Glossaries. The strings provided in glossaries will not be affected"+
              "by the BPE (i.e. they will neither be broken into subwords, nor concatenated with other subwords")
+    parser.add_argument(
+        '--cache-size', type=int, default=1000000,
+        metavar="INT",
+        help="Keep at most this many word segmentations in memory, 0 for no limit (default: %(default)s)")
+    parser.add_argument(
+        '--cache-dir', type=str, default=None,
+        metavar="PATH",
+        help="Directory with on-disk segmentation caches, one per codes file (and vocabulary, glossaries and separator). "+
+             "Segmentations from earlier runs with the same codes are reused, and new ones are added at the end")
+    parser.add_argument(
+        '--num-workers', '-j', type=int, default=1,
+        metavar="INT",
+        help="Segment the input with this many processes. The output order is preserved (default: %(default)s)")
+    parser.add_argument(
+        '--chunk-size', type=int, default=10000,
+        metavar="INT",
+        help="Number of lines segmented (and written) at a time, and sent to a worker at once (default: %(default)s)")
+    parser.add_argument(
+        '--encoder', type=str, default='heap', choices=['heap', 'legacy'],
+        help="Word encoder. 'heap' keeps the symbols of a word in a linked list and the candidate merges in a heap "+
+             "ordered by rank, 'legacy' rescans all pairs after every merge. The output is the same (default: %(default)s)")
 
     return parser
 
@@ -159,29 +602,10 @@ def get_pairs(word):
         prev_char = char
     return pairs
 
-def encode(orig, bpe_codes, bpe_codes_reverse, vocab, separator, version, cache, glossaries=None):
-    """Encode word based on list of BPE merge operations, which are applied consecutively
-    """
-
-    if orig in cache:
-        return cache[orig]
-
-    if orig in glossaries:
-        cache[orig] = (orig,)
-        return (orig,)
-
-    if version == (0, 1):
-        word = tuple(orig) + ('</w>',)
-    elif version == (0, 2): # more consistent handling of word-final segments
-        word = tuple(orig[:-1]) + ( orig[-1] + '</w>',)
-    else:
-        raise NotImplementedError
-
+def merge_pairs(word, bpe_codes):
+    """Apply BPE merges to word (tuple of symbols), lowest rank first, rebuilding the word after every merge"""
     pairs = get_pairs(word)
 
-    if not pairs:
-        return orig
-
     while True:
         bigram = min(pairs, key = lambda pair: bpe_codes.get(pair, float('inf')))
         if bigram not in bpe_codes:
@@ -211,6 +635,83 @@ def encode(orig, bpe_codes, bpe_codes_reverse, vocab, separator, version, cache,
         else:
             pairs = get_pairs(word)
 
+    return word
+
+def merge_pairs_heap(word, bpe_codes):
+    """Apply BPE merges to word (tuple of symbols), lowest rank first, like merge_pairs.
+
+    The symbols are kept in a linked list and the candidate merges in a heap ordered by (rank, position).
+    All occurrences of the best pair are popped together and merged left to right; a merge only adds
+    the (at most two) pairs around the new symbol. Entries that no longer match the word are skipped.
+    """
+    symbols = list(word)
+    length = len(symbols)
+    nxt = list(range(1, length + 1))
+    nxt[-1] = -1
+    prv = list(range(-1, length - 1))
+
+    heap = []
+    for i in range(length - 1):
+        rank = bpe_codes.get((symbols[i], symbols[i+1]))
+        if rank is not None:
+            heap.append((rank, i, symbols[i], symbols[i+1]))
+    heapq.heapify(heap)
+
+    while heap:
+        # a merge never creates another occurrence of the same pair, so the batch is complete
+        rank = heap[0][0]
+        batch = []
+        while heap and heap[0][0] == rank:
+            batch.append(heapq.heappop(heap))
+
+        for _, i, first, second in batch:
+            j = nxt[i]
+            if symbols[i] != first or j == -1 or symbols[j] != second:
+                continue
+            new_symbol = first + second
+            symbols[i] = new_symbol
+            symbols[j] = None
+            k = nxt[j]
+            nxt[i] = k
+            if k != -1:
+                prv[k] = i
+                new_rank = bpe_codes.get((new_symbol, symbols[k]))
+                if new_rank is not None:
+                    heapq.heappush(heap, (new_rank, i, new_symbol, symbols[k]))
+            p = prv[i]
+            if p != -1:
+                new_rank = bpe_codes.get((symbols[p], new_symbol))
+                if new_rank is not None:
+                    heapq.heappush(heap, (new_rank, p, symbols[p], new_symbol))
+
+    return tuple(symbol for symbol in symbols if symbol is not None)
+
+ENCODERS = {'heap': merge_pairs_heap, 'legacy': merge_pairs}
+
+def encode(orig, bpe_codes, bpe_codes_reverse, vocab, separator, version, cache, glossaries=None, merge=merge_pairs_heap,
+           split_table=None):
+    """Encode word based on list of BPE merge operations, which are applied consecutively
+    """
+
+    if orig in cache:
+        return cache[orig]
+
+    if orig in glossaries:
+        cache[orig] = (orig,)
+        return (orig,)
+
+    if version == (0, 1):
+        word = tuple(orig) + ('</w>',)
+    elif version == (0, 2): # more consistent handling of word-final segments
+        word = tuple(orig[:-1]) + ( orig[-1] + '</w>',)
+    else:
+        raise NotImplementedError
+
+    if len(word) < 2:
+        return orig
+
+    word = merge(word, bpe_codes)
+
     # don't print end-of-word symbols
     if word[-1] == '</w>':
         word = word[:-1]
@@ -218,7 +719,10 @@ def encode(orig, bpe_codes, bpe_codes_reverse, vocab, separator, version, cache,
         word = word[:-1] + (word[-1].replace('</w>',''),)
 
     if vocab:
-        word = check_vocab_and_split(word, bpe_codes_reverse, vocab, separator)
+        if split_table is not None:
+            word = split_with_table(word, split_table)
+        else:
+            word = check_vocab_and_split(word, bpe_codes_reverse, vocab, separator)
 
     cache[orig] = word
     return word
@@ -275,6 +779,71 @@ def check_vocab_and_split(orig, bpe_codes, vocab, separator):
     return out
 
 
+def build_split_table(bpe_codes, vocab, separator):
+    """Compute the output of check_vocab_and_split for every merged symbol, as a non-final and a final segment.
+
+    Returns two dicts from symbols to tuples of in-vocabulary (or unsplittable) units; symbols that are
+    kept as they are have no entry. Splits of the parts of a merge are memoized, so every node of the
+    reverse merge trees is visited once.
+    """
+    memo = {}
+
+    def split(segment, final):
+        key = (segment, final)
+        if key in memo:
+            return memo[key]
+        pair = bpe_codes.get(segment + '</w>' if final else segment)
+        if pair is None:
+            result = (segment,)
+        else:
+            left, right = pair
+            if final:
+                right = right[:-4]
+            result = (left,) if left + separator in vocab else split(left, False)
+            if (final and right in vocab) or (not final and right + separator in vocab):
+                result += (right,)
+            else:
+                result += split(right, final)
+        memo[key] = result
+        return result
+
+    nonfinal = {}
+    final = {}
+    for symbol in bpe_codes:
+        if symbol.endswith('</w>'):
+            segment = symbol[:-4]
+            if segment not in vocab:
+                final[segment] = split(segment, True)
+        elif symbol + separator not in vocab:
+            nonfinal[symbol] = split(symbol, False)
+    return nonfinal, final
+
+def split_with_table(orig, split_table):
+    """Same as check_vocab_and_split, using a table from build_split_table"""
+    nonfinal, final = split_table
+    out = []
+    for segment in orig[:-1]:
+        out.extend(nonfinal.get(segment, (segment,)))
+    segment = orig[-1]
+    out.extend(final.get(segment, (segment,)))
+    return out
+
+def save_split_table(path, key, split_table):
+    with open(path + '.tmp', 'wb') as fobj:
+        pickle.dump({'key': key, 'table': split_table}, fobj, pickle.HIGHEST_PROTOCOL)
+    os.replace(path + '.tmp', path)
+
+def load_split_table(path, key):
+    """Load a split table saved by save_split_table, or return None if there is none for these codes and vocabulary"""
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as fobj:
+        state = pickle.load(fobj)
+    if state['key'] != key:
+        sys.stderr.write('{0} was built for other codes or another vocabulary, rebuilding it\n'.format(path))
+        return None
+    return state['table']
+
 def read_vocabulary(vocab_file, threshold):
     """read vocabulary file produced by get_vocab.py, and filter according to frequency threshold.
     """
@@ -289,6 +858,14 @@ def read_vocabulary(vocab_file, threshold):
 
     return vocabulary
 
+def isolate_glossaries(word, glossaries):
+    """Isolate each glossary in turn, see isolate_glossary"""
+    word_segments = [word]
+    for gloss in glossaries:
+        word_segments = [out_segments for segment in word_segments
+                             for out_segments in isolate_glossary(segment, gloss)]
+    return word_segments
+
 def isolate_glossary(word, glossary):
     """
     Isolate a glossary present inside a word.
@@ -305,6 +882,42 @@ def isolate_glossary(word, glossary):
         segments = [segment.strip() for split in splits[:-1] for segment in [split, glossary] if segment != '']
         return segments + [splits[-1].strip()] if splits[-1] != '' else segments
 
+def read_chunks(fobj, chunk_size):
+    """Yield lists of (at most) chunk_size lines"""
+    while True:
+        chunk = list(islice(fobj, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+_worker_bpe = None
+
+def _init_worker(codes_path, compiled, run_id, *bpe_args):
+    global _worker_bpe
+    if compiled:
+        _worker_bpe = BPE.from_compiled(codes_path, *bpe_args[1:])
+    else:
+        _worker_bpe = BPE(codecs.open(codes_path, encoding='utf-8'), *bpe_args)
+    # cache entries are logged under the run of the parent, whose save() merges them
+    _worker_bpe.cache.run_id = run_id
+
+def _process_chunk(chunk):
+    out = ''.join([_worker_bpe.process_line(line) for line in chunk])
+    # workers exit without cleanup, so new cache entries are flushed after every chunk
+    _worker_bpe.cache.flush()
+    return out
+
+def process_parallel(infile, outfile, num_workers, chunk_size, codes_path, compiled, *bpe_args):
+    """Segment infile with a pool of num_workers processes, each with its own BPE(codes_path, *bpe_args)
+    (or BPE.from_compiled if compiled is set). Chunks of chunk_size lines are written to outfile in input order."""
+    pool = Pool(num_workers, _init_worker, (codes_path, compiled, os.getpid()) + bpe_args)
+    try:
+        for out in pool.imap(_process_chunk, read_chunks(infile, chunk_size)):
+            outfile.write(out)
+    finally:
+        pool.close()
+        pool.join()
+
 if __name__ == '__main__':
 
     # python 2/3 compatibility
@@ -320,8 +933,12 @@ if __name__ == '__main__':
     parser = create_parser()
     args = parser.parse_args()
 
+    if args.compile and not args.codes:
+        parser.error('--compile requires --codes')
+
     # read/write files as UTF-8
-    args.codes = codecs.open(args.codes.name, encoding='utf-8')
+    if args.codes:
+        args.codes = codecs.open(args.codes.name, encoding='utf-8')
     if args.input.name != '<stdin>':
         args.input = codecs.open(args.input.name, encoding='utf-8')
     if args.output.name != '<stdout>':
@@ -334,7 +951,28 @@ if __name__ == '__main__':
     else:
         vocabulary = None
 
-    bpe = BPE(args.codes, args.merges, args.separator, vocabulary, args.glossaries)
+    if args.cache_dir and not os.path.isdir(args.cache_dir):
+        os.makedirs(args.cache_dir)
+
+    bpe_args = (args.merges, args.separator, vocabulary, args.glossaries, args.encoder,
+                args.cache_size, args.cache_dir, args.split_table, args.boundary_marker)
+    if args.compiled_codes:
+        bpe = BPE.from_compiled(args.compiled_codes, *bpe_args[1:])
+        codes_path = args.compiled_codes
+    else:
+        bpe = BPE(args.codes, *bpe_args)
+        codes_path = args.codes.name
+
+    if args.compile:
+        write_compiled_codes(bpe, args.compile)
+        sys.exit(0)
+
+    if args.num_workers > 1:
+        process_parallel(args.input, args.output, args.num_workers, args.chunk_size, codes_path,
+                         bool(args.compiled_codes), *bpe_args)
+    else:
+        for chunk in read_chunks(args.input, args.chunk_size):
+            args.output.write(''.join([bpe.process_line(line) for line in chunk]))
 
-    for line in args.input:
-        args.output.write(bpe.process_line(line))
+    # with workers, this merges the cache entries they logged
+    bpe.cache.save()
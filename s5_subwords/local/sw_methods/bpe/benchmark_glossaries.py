@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Compare glossary isolation of apply_bpe.py (GlossaryMatcher) with applying isolate_glossary
+for every glossary in turn, on the words of a text, for a growing number of glossaries.
+
+Glossaries are sampled from the substrings of the words, so that some words contain one.
+Usage: benchmark_glossaries.py <text> [<glossary count> ...]
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+import random
+
+from apply_bpe import GlossaryMatcher, isolate_glossaries
+
+
+def main(text, counts):
+    with open(text, encoding='utf-8') as f_in:
+        words = [word for line in f_in for word in line.split()]
+    random.seed(0)
+    for count in counts:
+        glossaries = []
+        while len(glossaries) < count:
+            word = random.choice(words)
+            start = random.randrange(len(word))
+            glossaries.append(word[start:start + random.randint(2, 6)])
+
+        t0 = time.time()
+        sequential = [isolate_glossaries(word, glossaries) for word in words]
+        t1 = time.time()
+        matcher = GlossaryMatcher(glossaries)
+        t2 = time.time()
+        compiled = [matcher.isolate(word) for word in words]
+        t3 = time.time()
+
+        if sequential != compiled:
+            sys.exit('Error: segments differ for {0} glossaries'.format(count))
+        print('{0} glossaries, {1} words: sequential {2:.2f}s, compiled {3:.2f}s (+{4:.2f}s to build)'.format(
+            count, len(words), t1 - t0, t3 - t2, t2 - t1))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.exit(__doc__)
+    main(sys.argv[1], [int(x) for x in sys.argv[2:]] or [10, 1000, 10000])
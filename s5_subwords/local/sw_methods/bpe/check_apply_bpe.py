@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Run apply_bpe.py from the command line with each of its options and check that the output is the same
+as segmenting one line at a time with the legacy encoder. With --reference, the runs that only use options
+the reference apply_bpe.py also has are compared to its output too.
+
+Usage: check_apply_bpe.py <text> <codes> [--reference <apply_bpe.py>]
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from collections import Counter
+
+APPLY_BPE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'apply_bpe.py')
+
+
+def run(script, text, output, options):
+    subprocess.check_call([sys.executable, script, '-i', text, '-o', output] + options)
+    with open(output, encoding='utf-8') as f_in:
+        return f_in.read()
+
+
+def write_vocabulary(segmented, path, min_count=2):
+    """Subword units of the segmented text that occur at least min_count times, in get_vocab.py format"""
+    counts = Counter(segmented.split())
+    with open(path, 'w', encoding='utf-8') as f_out:
+        for unit, count in counts.most_common():
+            if count >= min_count:
+                f_out.write('{0} {1}\n'.format(unit, count))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that every apply_bpe.py option gives the same segmentation')
+    parser.add_argument('text', help='Text to segment')
+    parser.add_argument('codes', help='BPE codes (created by learn_bpe.py)')
+    parser.add_argument('--reference', default=None, help='Another apply_bpe.py to compare the runs it supports with')
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    try:
+        out = os.path.join(tmp, 'out')
+        codes = ['-c', args.codes]
+        plain = run(APPLY_BPE, args.text, out, codes)
+        vocab = os.path.join(tmp, 'vocab')
+        write_vocabulary(plain, vocab)
+        compiled = os.path.join(tmp, 'codes.bin')
+        subprocess.check_call([sys.executable, APPLY_BPE, '-c', args.codes, '--compile', compiled])
+        with open(args.text, encoding='utf-8') as f_in:
+            words = Counter(f_in.read().split())
+        # frequent words of a few characters, which also occur inside other words
+        glossaries = [word for word, _ in words.most_common() if len(word) > 2][:3]
+
+        # (name, options, options of the expected output, whether the reference has these options);
+        # the codes are added unless compiled codes are given
+        configurations = [
+            ('plain', [], [], True),
+            ('workers', ['-j', '3', '--chunk-size', '50'], [], False),
+            ('compiled codes', ['--compiled-codes', compiled], [], False),
+            ('compiled codes, workers', ['--compiled-codes', compiled, '-j', '2'], [], False),
+            ('cache dir', ['--cache-dir', os.path.join(tmp, 'cache')], [], False),
+            ('cache dir, reused', ['--cache-dir', os.path.join(tmp, 'cache'), '-j', '2'], [], False),
+            ('small cache', ['--cache-size', '10'], [], False),
+            ('merges', ['-m', '200'], ['-m', '200'], True),
+            ('vocabulary', ['--vocabulary', vocab, '--vocabulary-threshold', '3'],
+             ['--vocabulary', vocab, '--vocabulary-threshold', '3'], True),
+            ('split table', ['--vocabulary', vocab, '--split-table', os.path.join(tmp, 'split')], ['--vocabulary', vocab], False),
+            ('split table, reused', ['--vocabulary', vocab, '--split-table', os.path.join(tmp, 'split')], ['--vocabulary', vocab], False),
+            ('glossaries', ['--glossaries'] + glossaries, ['--glossaries'] + glossaries, True),
+        ]
+
+        failed = False
+        for name, options, expected_options, in_reference in configurations:
+            if '--compiled-codes' not in options:
+                options = codes + options
+            expected_options = codes + expected_options
+            expected = run(APPLY_BPE, args.text, out, expected_options + ['--encoder', 'legacy', '--cache-size', '0'])
+            output = run(APPLY_BPE, args.text, out, options)
+            result = 'same' if output == expected else 'DIFFERENT'
+            if args.reference and in_reference:
+                reference = run(args.reference, args.text, out, expected_options)
+                result += ', reference ' + ('same' if output == reference else 'DIFFERENT')
+            failed = failed or 'DIFFERENT' in result
+            print('{0}: {1}'.format(name, result))
+    finally:
+        shutil.rmtree(tmp)
+
+    if failed:
+        sys.exit('Error: apply_bpe.py output differs')
+
+
+if __name__ == '__main__':
+    main()
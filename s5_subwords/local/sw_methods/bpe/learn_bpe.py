@@ -16,11 +16,17 @@ from __future__ import unicode_literals
 from __future__ import division
 from __future__ import print_function
 
+import os
 import sys
 import codecs
 import re
 import copy
+import time
+import heapq
+import pickle
 import argparse
+from array import array
+from multiprocessing import Pool
 from collections import defaultdict, Counter
 
 # hack for python2/3 compatibility
@@ -44,17 +50,71 @@ def create_parser():
     parser.add_argument(
         '--symbols', '-s', type=int, default=10000,
         help="Create this many new symbols (each representing a character n-gram) (default: %(default)s))")
+    parser.add_argument(
+        '--checkpoints', type=checkpoint_list, default=None, metavar='N[,N...]',
+        help="Comma separated list of symbol counts, e.g. 500,1000,2000. Learn up to the largest one (instead of --symbols) "
+             "and also write the codes of each smaller count to its own file, named by --checkpoint-output. "
+             "The merges for N symbols are the first N merges of a larger run, so this equals one run per count.")
+    parser.add_argument(
+        '--checkpoint-output', type=str, default=None, metavar='PATH',
+        help="Path of the checkpoint codes files, '{}' is replaced by the symbol count "
+             "(default: the --output path followed by '.{}')")
     parser.add_argument(
         '--min-frequency', type=int, default=2, metavar='FREQ',
         help='Stop if no symbol pair has frequency >= FREQ (default: %(default)s))')
     parser.add_argument('--dict-input', action="store_true",
         help="If set, input file is interpreted as a dictionary where each line contains a word-count pair")
+    parser.add_argument(
+        '--jobs', '-j', type=int, default=1, metavar='N',
+        help="Count the vocabulary of the input text with N processes, each reading a part of the file. "
+             "Requires --input to be a file (default: %(default)s)")
+    parser.add_argument(
+        '--write-vocabulary', type=argparse.FileType('w'), default=None,
+        metavar='PATH',
+        help="Write the word counts of the input to this file, one word-count pair per line. "
+             "It can be used as input with --dict-input, or as --vocabulary for apply_bpe.py")
+    parser.add_argument(
+        '--engine', type=str, default='heap', choices=['heap', 'prune'],
+        help="Merge selection engine. 'heap' keeps the pair frequencies in a priority queue with lazy invalidation, "
+             "'prune' is the original max() search over pruned statistics. Both produce the same codes (default: %(default)s)")
+    parser.add_argument(
+        '--compact', action="store_true",
+        help="Intern symbols as integers and store each word as an array of symbol ids, which are merged in place. "
+             "Lowers memory use and time per merge on large vocabularies; the codes are unchanged. Requires the heap engine.")
+    parser.add_argument(
+        '--snapshot', type=str, default=None, metavar='PATH',
+        help="Periodically save the learning state (segmented vocabulary and merges so far) to this file, "
+             "so that an interrupted run can be continued with --resume")
+    parser.add_argument(
+        '--snapshot-interval', type=int, default=1000, metavar='N',
+        help="Save a snapshot every N merges (default: %(default)s)")
+    parser.add_argument(
+        '--resume', action="store_true",
+        help="Continue from the file given with --snapshot if it exists, instead of counting the input. "
+             "All merges of the snapshot are written to the output again. Without a snapshot, start from scratch")
+    parser.add_argument(
+        '--append', action="store_true",
+        help="With --resume, the input only contains new text. Its words are counted, segmented with the merges "
+             "of the snapshot, and added to the snapshot vocabulary before learning continues")
+    parser.add_argument(
+        '--continue-from', type=argparse.FileType('r'), default=None, metavar='PATH',
+        help="Existing BPE codes file. Its merges are applied to the input vocabulary and kept as the first "
+             "merges of the output; learning continues up to --symbols merges in total")
     parser.add_argument(
         '--verbose', '-v', action="store_true",
         help="verbose mode.")
 
     return parser
 
+def checkpoint_list(s):
+    try:
+        checkpoints = sorted(set(int(x) for x in s.split(',') if x))
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid checkpoint list: {0}'.format(s))
+    if not checkpoints or checkpoints[0] < 1:
+        raise argparse.ArgumentTypeError('checkpoints must be positive integers: {0}'.format(s))
+    return checkpoints
+
 def get_vocabulary(fobj, is_dict=False):
     """Read text and return dictionary that encodes vocabulary
     """
@@ -73,6 +133,61 @@ def get_vocabulary(fobj, is_dict=False):
                     vocab[word] += 1
     return vocab
 
+def shard_offsets(path, jobs):
+    """Split a file into (at most) jobs byte ranges, each starting at the beginning of a line"""
+    size = os.path.getsize(path)
+    offsets = [0]
+    with open(path, 'rb') as fobj:
+        for k in range(1, jobs):
+            fobj.seek(max(size * k // jobs, offsets[-1]))
+            if fobj.tell():
+                fobj.readline()
+            if fobj.tell() >= size:
+                break
+            if fobj.tell() > offsets[-1]:
+                offsets.append(fobj.tell())
+    offsets.append(size)
+    return list(zip(offsets[:-1], offsets[1:]))
+
+
+def read_shard(path, start, end):
+    """Yield the lines of a UTF-8 file that start in the byte range [start, end)"""
+    with open(path, 'rb') as fobj:
+        fobj.seek(start)
+        while fobj.tell() < end:
+            line = fobj.readline()
+            if not line:
+                break
+            # same line boundaries as a codecs reader
+            for item in line.decode('utf-8').splitlines(True):
+                yield item
+
+
+def _count_shard(shard):
+    path, start, end = shard
+    return get_vocabulary(read_shard(path, start, end))
+
+
+def get_vocabulary_parallel(path, jobs):
+    """Count the vocabulary of a text file with a pool of jobs processes, one per byte range of the file"""
+    shards = [(path, start, end) for (start, end) in shard_offsets(path, jobs)]
+    vocab = Counter()
+    pool = Pool(min(jobs, len(shards)))
+    try:
+        for shard_vocab in pool.imap(_count_shard, shards):
+            vocab.update(shard_vocab)
+    finally:
+        pool.close()
+        pool.join()
+    return vocab
+
+
+def write_vocabulary(vocab, fobj):
+    """Write vocabulary as word-count pairs, most frequent first (the format read with --dict-input)"""
+    for word, count in sorted(vocab.items(), key=lambda x: x[1], reverse=True):
+        fobj.write('{0} {1}\n'.format(word, count))
+
+
 def update_pair_statistics(pair, changed, stats, indices):
     """Minimally update the indices and frequency of symbol pairs
 
@@ -177,6 +292,102 @@ def replace_pair(pair, vocab, indices):
 
     return changes
 
+def intern_vocabulary(sorted_vocab):
+    """Intern all symbols as integers and store each word as array('i') of symbol ids.
+
+    Returns the compact vocabulary (same order and frequencies as sorted_vocab) and the list of symbols,
+    where the position of a symbol is its id.
+    """
+    symbols = []
+    symbol_ids = {}
+    compact_vocab = []
+    for word, freq in sorted_vocab:
+        ids = array('i')
+        for symbol in word:
+            symbol_id = symbol_ids.get(symbol)
+            if symbol_id is None:
+                symbol_id = symbol_ids[symbol] = len(symbols)
+                symbols.append(symbol)
+            ids.append(symbol_id)
+        compact_vocab.append((ids, freq))
+    return compact_vocab, symbols
+
+
+def replace_pair_compact(pair, new_id, vocab, indices):
+    """Replace all occurrences of a pair of symbol ids (A, B) with new_id, rewriting the word arrays in place"""
+    first, second = pair
+    changes = []
+    for j, freq in indices[pair].items():
+        if freq < 1:
+            continue
+        word, freq = vocab[j]
+        old_word = word[:]
+        length = len(word)
+        i = k = 0
+        while i < length:
+            if i < length-1 and old_word[i] == first and old_word[i+1] == second:
+                word[k] = new_id
+                i += 2
+            else:
+                word[k] = old_word[i]
+                i += 1
+            k += 1
+        del word[k:]
+        changes.append((j, word, old_word, freq))
+
+    return changes
+
+
+def update_pair_statistics_compact(pair, new_id, changed, stats, indices):
+    """Minimally update the indices and frequency of pairs of symbol ids
+
+    Same as update_pair_statistics, for words stored as arrays of symbol ids.
+    """
+    stats[pair] = 0
+    indices[pair] = defaultdict(int)
+    first, second = pair
+    for j, word, old_word, freq in changed:
+
+        # find all instances of pair, and update frequency/indices around it
+        length = len(old_word)
+        i = 0
+        while i < length-1:
+            if old_word[i] != first:
+                i += 1
+            elif old_word[i+1] == second:
+                # assuming a symbol sequence "A B C", if "B C" is merged, reduce the frequency of "A B"
+                if i:
+                    prev = (old_word[i-1], first)
+                    stats[prev] -= freq
+                    indices[prev][j] -= 1
+                if i < length-2:
+                    # assuming a symbol sequence "A B C B", if "B C" is merged, reduce the frequency of "C B".
+                    # however, skip this if the sequence is A B C B C, because the frequency of "C B" will be reduced by the previous code block
+                    if old_word[i+2] != first or i >= length-3 or old_word[i+3] != second:
+                        nex = (second, old_word[i+2])
+                        stats[nex] -= freq
+                        indices[nex][j] -= 1
+                i += 2
+            else:
+                i += 1
+
+        length = len(word)
+        for i in range(length):
+            if word[i] != new_id:
+                continue
+            # assuming a symbol sequence "A BC D", if "B C" is merged, increase the frequency of "A BC"
+            if i:
+                prev = (word[i-1], new_id)
+                stats[prev] += freq
+                indices[prev][j] += 1
+            # assuming a symbol sequence "A BC B", if "B C" is merged, increase the frequency of "BC B"
+            # however, if the sequence is A BC BC, skip this step because the count of "BC BC" will be incremented by the previous code block
+            if i < length-1 and word[i+1] != new_id:
+                nex = (new_id, word[i+1])
+                stats[nex] += freq
+                indices[nex][j] += 1
+
+
 def prune_stats(stats, big_stats, threshold):
     """Prune statistics dict for efficiency of max()
 
@@ -193,19 +404,132 @@ def prune_stats(stats, big_stats, threshold):
                 big_stats[item] = freq
 
 
-def main(infile, outfile, num_symbols, min_frequency=2, verbose=False, is_dict=False):
-    """Learn num_symbols BPE operations from vocabulary, and write to outfile.
-    """
+def read_codes(fobj):
+    """Read merge operations from a BPE codes file"""
+    merges = []
+    for line in fobj:
+        if line.startswith('#version:'):
+            continue
+        pair = tuple(line.strip('\r\n ').split(' '))
+        if len(pair) != 2:
+            sys.stderr.write('Error: invalid line in BPE codes file: {0}\n'.format(line.strip()))
+            sys.exit(1)
+        merges.append(pair)
+    return merges
 
-    # version 0.2 changes the handling of the end-of-word token ('</w>');
-    # version numbering allows bckward compatibility
-    outfile.write('#version: 0.2\n')
 
-    vocab = get_vocabulary(infile, is_dict)
-    vocab = dict([(tuple(x[:-1])+(x[-1]+'</w>',) ,y) for (x,y) in vocab.items()])
-    sorted_vocab = sorted(vocab.items(), key=lambda x: x[1], reverse=True)
+def segment_vocabulary(vocab, merges):
+    """Apply merge operations to every word of vocab (a dict from symbol tuples to counts)
 
-    stats, indices = get_pair_statistics(sorted_vocab)
+    Applying the pair with the lowest rank first gives the same segmentation as replaying the merges in order,
+    since a pair created by a merge always has a higher rank than the merge itself.
+    """
+    bpe_ranks = dict((pair, i) for (i, pair) in reversed(list(enumerate(merges))))
+    segmented = defaultdict(int)
+    for word, freq in vocab.items():
+        while len(word) > 1:
+            bigram = min(zip(word, word[1:]), key=lambda pair: bpe_ranks.get(pair, float('inf')))
+            if bigram not in bpe_ranks:
+                break
+            first, second = bigram
+            new_word = []
+            i = 0
+            while i < len(word):
+                if i < len(word)-1 and word[i] == first and word[i+1] == second:
+                    new_word.append(first+second)
+                    i += 2
+                else:
+                    new_word.append(word[i])
+                    i += 1
+            word = tuple(new_word)
+        segmented[word] += freq
+    return segmented
+
+
+def save_snapshot(path, sorted_vocab, merges, symbols=None):
+    """Save the learning state to path.
+
+    The vocabulary is stored as interned symbols, with all words in one flat array of symbol ids.
+    Pair statistics and indices are not stored; they are rebuilt from the vocabulary on resume.
+    The file is replaced atomically, so an interrupted write leaves the previous snapshot intact.
+    """
+    if symbols is None:
+        sorted_vocab, symbols = intern_vocabulary(sorted_vocab)
+    lengths = array('i')
+    ids = array('i')
+    freqs = array('q')
+    for word, freq in sorted_vocab:
+        lengths.append(len(word))
+        ids.extend(word)
+        freqs.append(freq)
+    state = {'version': 1,
+             'symbols': symbols,
+             'lengths': lengths.tobytes(),
+             'ids': ids.tobytes(),
+             'freqs': freqs.tobytes(),
+             'merges': merges}
+    with open(path + '.tmp', 'wb') as fobj:
+        pickle.dump(state, fobj, pickle.HIGHEST_PROTOCOL)
+    os.replace(path + '.tmp', path)
+
+
+def load_snapshot(path):
+    """Load a snapshot written by save_snapshot, and return the vocabulary (as symbol tuples) and the merges"""
+    with open(path, 'rb') as fobj:
+        state = pickle.load(fobj)
+    symbols = state['symbols']
+    lengths = array('i')
+    lengths.frombytes(state['lengths'])
+    ids = array('i')
+    ids.frombytes(state['ids'])
+    freqs = array('q')
+    freqs.frombytes(state['freqs'])
+    sorted_vocab = []
+    start = 0
+    for length, freq in zip(lengths, freqs):
+        sorted_vocab.append((tuple(symbols[k] for k in ids[start:start+length]), freq))
+        start += length
+    return sorted_vocab, [tuple(pair) for pair in state['merges']]
+
+
+class TrackedStats(defaultdict):
+    """Pair frequency dict that remembers which pairs were modified since the last call to pop_touched()"""
+
+    def __init__(self, *args):
+        defaultdict.__init__(self, int, *args)
+        self.touched = set()
+
+    def __setitem__(self, key, value):
+        self.touched.add(key)
+        defaultdict.__setitem__(self, key, value)
+
+    def pop_touched(self):
+        touched = self.touched
+        self.touched = set()
+        return touched
+
+
+class _MaxPair(object):
+    """Heap key that orders pairs in reverse, so that heapq (a min-heap) pops the largest pair on frequency ties,
+    matching max(stats, key=lambda x: (stats[x], x)). key is the pair of symbol strings the order is based on."""
+    __slots__ = ('pair', 'key')
+
+    def __init__(self, pair, key=None):
+        self.pair = pair
+        self.key = pair if key is None else key
+
+    def __lt__(self, other):
+        return self.key > other.key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+
+def prune_merges(sorted_vocab, stats, indices, num_symbols, min_frequency=2, verbose=False):
+    """Yield up to num_symbols merge operations, selected by max() over pruned pair statistics.
+
+    The merge is applied to sorted_vocab, stats and indices before the pair is yielded.
+    """
     big_stats = copy.deepcopy(stats)
     # threshold is inspired by Zipfian assumption, but should only affect speed
     threshold = max(stats.values()) / 10
@@ -228,12 +552,184 @@ def main(infile, outfile, num_symbols, min_frequency=2, verbose=False, is_dict=F
 
         if verbose:
             sys.stderr.write('pair {0}: {1} {2} -> {1}{2} (frequency {3})\n'.format(i, most_frequent[0], most_frequent[1], stats[most_frequent]))
-        outfile.write('{0} {1}\n'.format(*most_frequent))
         changes = replace_pair(most_frequent, sorted_vocab, indices)
         update_pair_statistics(most_frequent, changes, stats, indices)
         stats[most_frequent] = 0
         if not i % 100:
             prune_stats(stats, big_stats, threshold)
+        yield most_frequent
+
+
+def heap_merges(sorted_vocab, stats, indices, num_symbols, min_frequency=2, verbose=False, symbols=None):
+    """Yield up to num_symbols merge operations, selected from a priority queue of pair frequencies.
+
+    Every pair whose frequency changes is pushed again with its new frequency; stale heap entries
+    are discarded when they reach the top (lazy invalidation). Each merge therefore costs O(log n)
+    per affected pair instead of a scan over all pairs, and no copy of the statistics is needed.
+    The merge is applied to sorted_vocab, stats and indices before the pair is yielded.
+
+    If symbols is given, sorted_vocab is in compact form (see intern_vocabulary) and symbols
+    maps symbol ids back to strings. New symbols are appended to it. The yielded pairs are always strings.
+    """
+    if symbols is None:
+        def entry(pair, freq):
+            return (-freq, _MaxPair(pair))
+    else:
+        symbol_ids = dict((symbol, i) for (i, symbol) in enumerate(symbols))
+
+        def entry(pair, freq):
+            return (-freq, _MaxPair(pair, (symbols[pair[0]], symbols[pair[1]])))
+
+    stats = TrackedStats(stats)
+    heap = [entry(pair, freq) for pair, freq in stats.items()]
+    heapq.heapify(heap)
+    stats.pop_touched()
+
+    for i in range(num_symbols):
+        most_frequent = None
+        while heap:
+            neg_freq, key = heap[0]
+            if stats.get(key.pair) == -neg_freq:
+                most_frequent = key.pair
+                break
+            heapq.heappop(heap)
+
+        if most_frequent is None or stats[most_frequent] < min_frequency:
+            sys.stderr.write('no pair has frequency >= {0}. Stopping\n'.format(min_frequency))
+            break
+
+        if symbols is None:
+            merged = most_frequent
+        else:
+            merged = (symbols[most_frequent[0]], symbols[most_frequent[1]])
+
+        if verbose:
+            sys.stderr.write('pair {0}: {1} {2} -> {1}{2} (frequency {3})\n'.format(i, merged[0], merged[1], stats[most_frequent]))
+
+        if symbols is None:
+            changes = replace_pair(most_frequent, sorted_vocab, indices)
+            update_pair_statistics(most_frequent, changes, stats, indices)
+        else:
+            new_symbol = merged[0] + merged[1]
+            new_id = symbol_ids.get(new_symbol)
+            if new_id is None:
+                new_id = symbol_ids[new_symbol] = len(symbols)
+                symbols.append(new_symbol)
+            changes = replace_pair_compact(most_frequent, new_id, sorted_vocab, indices)
+            update_pair_statistics_compact(most_frequent, new_id, changes, stats, indices)
+        stats[most_frequent] = 0
+
+        for pair in stats.pop_touched():
+            heapq.heappush(heap, entry(pair, stats[pair]))
+
+        # drop stale entries once they dominate the heap
+        if len(heap) > 4 * len(stats):
+            heap = [entry(pair, freq) for pair, freq in stats.items()]
+            heapq.heapify(heap)
+
+        yield merged
+
+
+ENGINES = {'heap': heap_merges, 'prune': prune_merges}
+
+
+def main(infile, outfile, num_symbols, min_frequency=2, verbose=False, is_dict=False, engine='heap', compact=False,
+         jobs=1, vocab_outfile=None, checkpoints=None, snapshot=None, snapshot_interval=1000, resume=False,
+         append=False, codes_infile=None):
+    """Learn num_symbols BPE operations from vocabulary, and write to outfile.
+
+    With jobs > 1 the vocabulary of a text input file is counted in parallel. If vocab_outfile is given,
+    the word counts are written to it before learning starts.
+    checkpoints is a list of (count, file) pairs; the first count merges are also written to each file,
+    which is closed once it is complete.
+    If snapshot is given, the state is saved there every snapshot_interval merges and at the end. With resume,
+    learning continues from that snapshot (adding the words of infile to it with append). Otherwise, if
+    codes_infile is given, its merges are applied to the vocabulary and learning continues after them.
+    """
+    checkpoints = sorted(checkpoints or [], key=lambda x: x[0])
+
+    def count():
+        if jobs > 1 and not is_dict:
+            vocab = get_vocabulary_parallel(infile.name, jobs)
+        else:
+            vocab = get_vocabulary(infile, is_dict)
+
+        if vocab_outfile is not None:
+            write_vocabulary(vocab, vocab_outfile)
+            vocab_outfile.close()
+
+        return dict([(tuple(x[:-1])+(x[-1]+'</w>',) ,y) for (x,y) in vocab.items()])
+
+    if resume and snapshot and os.path.exists(snapshot):
+        sorted_vocab, previous = load_snapshot(snapshot)
+        sys.stderr.write('resuming from {0} after {1} merges\n'.format(snapshot, len(previous)))
+        if append:
+            vocab = dict(sorted_vocab)
+            for word, freq in segment_vocabulary(count(), previous).items():
+                vocab[word] = vocab.get(word, 0) + freq
+            sorted_vocab = sorted(vocab.items(), key=lambda x: x[1], reverse=True)
+            del vocab
+    else:
+        vocab = count()
+        previous = read_codes(codes_infile) if codes_infile is not None else []
+        if previous:
+            vocab = segment_vocabulary(vocab, previous)
+        sorted_vocab = sorted(vocab.items(), key=lambda x: x[1], reverse=True)
+        del vocab
+
+    # version 0.2 changes the handling of the end-of-word token ('</w>');
+    # version numbering allows bckward compatibility
+    outfile.write('#version: 0.2\n')
+    for _, checkpoint_file in checkpoints:
+        checkpoint_file.write('#version: 0.2\n')
+
+    def write_merge(pair):
+        line = '{0} {1}\n'.format(*pair)
+        outfile.write(line)
+        for _, checkpoint_file in checkpoints:
+            checkpoint_file.write(line)
+        while checkpoints and checkpoints[0][0] <= len(learned):
+            checkpoints.pop(0)[1].close()
+
+    learned = []
+    for pair in previous[:num_symbols]:
+        learned.append(pair)
+        write_merge(pair)
+
+    symbols = None
+    if compact:
+        if engine != 'heap':
+            raise ValueError('compact mode requires the heap engine')
+        sorted_vocab, symbols = intern_vocabulary(sorted_vocab)
+
+    stats, indices = get_pair_statistics(sorted_vocab)
+
+    remaining = max(num_symbols - len(learned), 0)
+    if compact:
+        merge_iter = heap_merges(sorted_vocab, stats, indices, remaining, min_frequency, verbose, symbols)
+    else:
+        merge_iter = ENGINES[engine](sorted_vocab, stats, indices, remaining, min_frequency, verbose)
+
+    t0 = time.time()
+    num_merges = 0
+    for most_frequent in merge_iter:
+        learned.append(most_frequent)
+        write_merge(most_frequent)
+        num_merges += 1
+        if snapshot and not num_merges % snapshot_interval:
+            save_snapshot(snapshot, sorted_vocab, learned, symbols)
+
+    # learning stopped early; the remaining checkpoints are the same as the full output
+    for _, checkpoint_file in checkpoints:
+        checkpoint_file.close()
+
+    # the vocabulary is only consistent with the merges if none of the previous ones were dropped
+    if snapshot and len(previous) <= num_symbols:
+        save_snapshot(snapshot, sorted_vocab, learned, symbols)
+
+    elapsed = time.time() - t0
+    sys.stderr.write('learned {0} merges in {1:.1f}s ({2:.1f} merges/s, {3} engine{4})\n'.format(
+        num_merges, elapsed, num_merges / elapsed if elapsed else 0.0, engine, ', compact' if compact else ''))
 
 
 if __name__ == '__main__':
@@ -250,11 +746,37 @@ if __name__ == '__main__':
 
     parser = create_parser()
     args = parser.parse_args()
+    if args.compact and args.engine != 'heap':
+        parser.error('--compact requires --engine heap')
+    if args.jobs > 1 and args.input.name == '<stdin>' and not args.dict_input:
+        parser.error('--jobs requires --input to be a file')
+    if args.resume and not args.snapshot:
+        parser.error('--resume requires --snapshot')
+    if args.append and not args.resume:
+        parser.error('--append requires --resume')
 
     # read/write files as UTF-8
     if args.input.name != '<stdin>':
         args.input = codecs.open(args.input.name, encoding='utf-8')
     if args.output.name != '<stdout>':
         args.output = codecs.open(args.output.name, 'w', encoding='utf-8')
-
-    main(args.input, args.output, args.symbols, args.min_frequency, args.verbose, is_dict=args.dict_input)
+    if args.write_vocabulary:
+        args.write_vocabulary = codecs.open(args.write_vocabulary.name, 'w', encoding='utf-8')
+    if args.continue_from:
+        args.continue_from = codecs.open(args.continue_from.name, encoding='utf-8')
+
+    checkpoints = []
+    if args.checkpoints:
+        args.symbols = args.checkpoints[-1]
+        checkpoint_output = args.checkpoint_output
+        if checkpoint_output is None:
+            if args.output.name == '<stdout>':
+                parser.error('--checkpoints with output to standard output requires --checkpoint-output')
+            checkpoint_output = args.output.name + '.{}'
+        for n in args.checkpoints[:-1]:
+            checkpoints.append((n, codecs.open(checkpoint_output.format(n), 'w', encoding='utf-8')))
+
+    main(args.input, args.output, args.symbols, args.min_frequency, args.verbose, is_dict=args.dict_input,
+         engine=args.engine, compact=args.compact, jobs=args.jobs, vocab_outfile=args.write_vocabulary,
+         checkpoints=checkpoints, snapshot=args.snapshot, snapshot_interval=args.snapshot_interval,
+         resume=args.resume, append=args.append, codes_infile=args.continue_from)
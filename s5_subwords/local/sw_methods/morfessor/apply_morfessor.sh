@@ -4,10 +4,20 @@
 # The tool is avalible here https://github.com/Waino/morfessor-emprune
 # Author David Erik Mollberg
 
+# Begin configuration section
+separator="@@"
+boundary_marker="r"
+nj=1
+# End configuration section
+
+. utils/parse_options.sh
 
 if  [ $# -ne 3 ] && [ $# -ne 4 ]; then
-  echo "Usage: morfessor.sh <text corpus> <subword unit count> <subword directory>"
-  echo "e.g.: ./morfessor.sh rmh 1000 "
+  echo "Usage: apply_morfessor.sh [options] <text corpus> <subword directory> <output> [<kaldi text>]"
+  echo "e.g.: ./apply_morfessor.sh --boundary-marker lr rmh data/local/models/morfessor_1000_lr rmh.sub"
+  echo "    --separator <separator>              # default: @@"
+  echo "    --boundary-marker <r|l|lr|wb>        # default: r"
+  echo "    --nj <num-workers>                   # default: 1"
   exit 1;
 fi
 
@@ -20,26 +30,28 @@ kaldi_text="${4:-false}"
 tmp=$subword_dir/tmp
 mkdir -p $tmp
 
+kaldi_text_opt=
 if [ $kaldi_text == 'true' ] || [ $kaldi_text == 'True' ]; then
-  cut -d" " -f2- $text > $tmp/text
-  cut -d" " -f1 $text > $tmp/ids
-  text=$tmp/text
+  kaldi_text_opt="--kaldi_text"
+  cut -d" " -f2- $text | tr -s ' ' '\n' | sort -u > $tmp/words
+else
+  tr -s ' ' '\n' < $text | sort -u > $tmp/words
 fi
 
-echo "$0: Segmenting test corpus"
-morfessor-segment $text \
+# Every word is segmented once, and the segmentations are applied to the corpus in one streaming pass
+echo "$0: Segmenting the words of the corpus"
+morfessor-segment $tmp/words \
                   --em-prune $subword_dir/emprune.model \
                   --output-format-separator '@@ ' \
-                  -o $tmp/segment 
+                  -o $tmp/segment
 
 python3 local/sw_methods/morfessor/apply_segments_to_text.py $tmp/segment \
                                                              $text \
-                                                             $tmp/text.sub
-
-if [ $kaldi_text == 'true' ] || [ $kaldi_text == 'True' ]; then
-  paste -d ' ' $tmp/ids $tmp/text.sub > $output
-else
-  mv $tmp/text.sub $output
-fi
+                                                             $output \
+                                                             --table $tmp/segment.bin \
+                                                             --separator $separator \
+                                                             --boundary_marker $boundary_marker \
+                                                             --num_workers $nj \
+                                                             $kaldi_text_opt
 
 rm -r $tmp
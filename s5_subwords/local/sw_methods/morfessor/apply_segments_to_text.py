@@ -1,27 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Apply Morfessor segmentations to a text corpus.
+# The segmentations are the output of morfessor-segment, one word per line with its morphs
+# separated by '@@ '. They are compiled into a memory-mapped hash table (next to the segmentation
+# file by default), so the worker processes share one copy, and the corpus is streamed in chunks.
+
+import os
 import sys
+import mmap
+import struct
+import zlib
+import argparse
+from array import array
+from itertools import islice
+from multiprocessing import Pool
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from boundary_markers import format_words
+
+# How apply_morfessor.sh tells morfessor-segment to separate the morphs
+SEGMENT_SEPARATOR = '@@ '
 
-segmented_file = sys.argv[1]
-corpus = sys.argv[2]
-output = sys.argv[3]
+TABLE_MAGIC = b'MORFSEG1'
 
-segments:dict = {}
-with open(segmented_file) as f_in:
-    for line in f_in:
-        line = line.rstrip()
-        if "@@" in line:
-            word = line.replace('@@ ', '')
-            segments[word] = line
 
-with open(corpus) as f_in:
-    with open(output, 'w') as f_out:
+def read_segmentations(segmented_file):
+    """Yield (word, morphs) for the words that are split into more than one morph"""
+    with open(segmented_file) as f_in:
         for line in f_in:
-            for word in line.split(' '):
-                word = word.rstrip()
-                if word in segments.keys():
-                    f_out.write(segments[word] + ' ')
-                else:
-                    f_out.write(word + ' ')
-            f_out.write('\n')
+            line = line.rstrip()
+            if SEGMENT_SEPARATOR in line:
+                morphs = line.split(SEGMENT_SEPARATOR)
+                yield ''.join(morphs), morphs
+
+
+def write_segment_table(segmented_file, path):
+    """Compile segmented_file to a binary file that SegmentTable memory-maps.
+
+    Layout (little-endian): magic, number of records, table size (uint64 each), record offsets,
+    open addressing (linear probing) table of record numbers indexed by crc32 of the word (int64,
+    -1 for empty slots) and the records: 'word morph morph ...' in UTF-8.
+    If a word is listed more than once, its last segmentation is kept.
+    """
+    segmentations = dict(read_segmentations(segmented_file))
+    records = [' '.join([word] + morphs).encode('utf-8') for word, morphs in segmentations.items()]
+    del segmentations
+
+    size = 1
+    while size < 2 * len(records):
+        size *= 2
+    table = array('q', [-1]) * size
+    for i, record in enumerate(records):
+        slot = zlib.crc32(record[:record.index(b' ')]) & (size - 1)
+        while table[slot] >= 0:
+            slot = (slot + 1) & (size - 1)
+        table[slot] = i
+
+    offsets = array('Q', [0])
+    for record in records:
+        offsets.append(offsets[-1] + len(record))
+
+    with open(path + '.tmp', 'wb') as f_out:
+        f_out.write(TABLE_MAGIC)
+        f_out.write(struct.pack('<QQ', len(records), size))
+        f_out.write(offsets.tobytes())
+        f_out.write(table.tobytes())
+        for record in records:
+            f_out.write(record)
+    os.replace(path + '.tmp', path)
+
+
+class SegmentTable(object):
+    """Read-only map from words to their morphs, backed by a file written by write_segment_table.
+    Lookups are memoized per process; the table itself stays in the (shared) memory-mapped file."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f_in:
+            self.buf = mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.buf[:8] != TABLE_MAGIC:
+            raise ValueError(f'{path} is not a compiled segmentation table')
+        num_records, size = struct.unpack('<QQ', self.buf[8:24])
+        view = memoryview(self.buf)
+        start = 24
+        self.records = view[start:start + 8 * (num_records + 1)].cast('Q')
+        start += 8 * (num_records + 1)
+        self.table = view[start:start + 8 * size].cast('q')
+        self.pool_start = start + 8 * size
+        self.mask = size - 1
+        self.memo = {}
+
+    def _find(self, word):
+        key = word.encode('utf-8') + b' '
+        slot = zlib.crc32(key[:-1]) & self.mask
+        while True:
+            i = self.table[slot]
+            if i < 0:
+                return None
+            record = self.buf[self.pool_start + self.records[i]:self.pool_start + self.records[i+1]]
+            if record.startswith(key):
+                return record[len(key):].decode('utf-8').split(' ')
+            slot = (slot + 1) & self.mask
+
+    def get(self, word):
+        """The morphs of word, or [word] if it isn't segmented"""
+        try:
+            return self.memo[word]
+        except KeyError:
+            morphs = self.memo[word] = self._find(word) or [word]
+            return morphs
+
+    def __len__(self):
+        return len(self.records) - 1
+
+
+def split_words(line):
+    """The words of line split on single spaces, as the corpus has always been split here,
+    so that runs of spaces are kept"""
+    return [word.rstrip() for word in line.split(' ')]
+
+
+def segment_line(line, table, separator='@@', bm='r', kaldi_text=False):
+    if kaldi_text:
+        utt_id, _, line = line.partition(' ')
+        return utt_id.rstrip() + ' ' + format_words([table.get(word) for word in split_words(line)], separator, bm) + '\n'
+    return format_words([table.get(word) for word in split_words(line)], separator, bm) + '\n'
+
+
+def read_chunks(f_in, chunk_size):
+    """Yield lists of (at most) chunk_size lines"""
+    while True:
+        chunk = list(islice(f_in, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+_worker_args = None
+
+def _init_worker(table_path, *args):
+    global _worker_args
+    _worker_args = (SegmentTable(table_path),) + args
+
+def _process_chunk(chunk):
+    return ''.join([segment_line(line, *_worker_args) for line in chunk])
+
+def apply_segments(corpus, output, table_path, separator='@@', bm='r', kaldi_text=False, num_workers=1, chunk_size=10000):
+    """Segment corpus with the table at table_path and write it to output. With num_workers > 1, chunks
+    of chunk_size lines are segmented by a pool of processes and written in input order."""
+    with open(corpus) as f_in, open(output, 'w') as f_out:
+        if num_workers > 1:
+            pool = Pool(num_workers, _init_worker, (table_path, separator, bm, kaldi_text))
+            try:
+                for out in pool.imap(_process_chunk, read_chunks(f_in, chunk_size)):
+                    f_out.write(out)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            table = SegmentTable(table_path)
+            for chunk in read_chunks(f_in, chunk_size):
+                f_out.write(''.join([segment_line(line, table, separator, bm, kaldi_text) for line in chunk]))
+
 
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Apply Morfessor segmentations from morfessor-segment to a text corpus')
+    parser.add_argument('segmented_file', help="Output of morfessor-segment, one word per line with the morphs separated by '@@ '")
+    parser.add_argument('corpus', help='Text to segment')
+    parser.add_argument('output', help='Path to the output file')
+    parser.add_argument('--table', type=str, default=None, metavar='PATH',
+        help="Compiled segmentation table, built from segmented_file if it's missing or older (default: segmented_file.bin)")
+    parser.add_argument('--separator', '-s', type=str, default='@@', metavar='STR',
+        help="Subword separator (default: '%(default)s')")
+    parser.add_argument('--boundary_marker', '-bm', type=str, default='r', choices=['r', 'l', 'lr', 'wb'],
+        help="Boundary marker style (default: '%(default)s')")
+    parser.add_argument('--kaldi_text', action='store_true',
+        help='The corpus is a Kaldi text file; the first field of every line is kept as is')
+    parser.add_argument('--num_workers', '-j', type=int, default=1,
+        help='Segment the corpus with this many processes. The output order is preserved (default: %(default)s)')
+    parser.add_argument('--chunk_size', type=int, default=10000,
+        help='Number of lines segmented (and written) at a time (default: %(default)s)')
+    args = parser.parse_args()
 
+    table_path = args.table or args.segmented_file + '.bin'
+    if not os.path.exists(table_path) or os.path.getmtime(table_path) < os.path.getmtime(args.segmented_file):
+        write_segment_table(args.segmented_file, table_path)
 
+    apply_segments(args.corpus, args.output, table_path, args.separator, args.boundary_marker,
+                   args.kaldi_text, args.num_workers, args.chunk_size)
@@ -1,72 +1,49 @@
 #!/usr/bin/env python3
 
 import sentencepiece as spm
-import re   
 import argparse
+import logging
+import os
 import sys
+import time
+from itertools import islice
 
-def parse(i_path:str, o_stream:str, model, kaldi_text=True, separator='+', bm='lr'):
-    with open(i_path) as f_in:
-        for line in f_in:
-            if kaldi_text:
-                id = line.split(' ')[0]
-                line = ' '.join(line.split(' ')[1:])
-            line = line.rstrip()
-            line_tok = model.encode_as_pieces(line)
-            parsed = ''
-
-            print(line_tok)
-            if bm == 'wb':
-                parsed = ' '.join(line_tok)
-                print(parsed)
-                parsed = re.sub('^▁', '', parsed)
-                parsed = re.sub(' ▁', f' {separator} ', parsed)
-                print(parsed)
-
-            else:
-                parsed = ''
-                tok_iter = iter(line_tok)
-                while True:
-                    try:
-                        tok = next(tok_iter)
-                        if tok == '▁':
-                            # This indicates that the next token is a whole word  
-                            # and we will add that word to the parsed text
-
-                            parsed += ' ' + next(tok_iter)
-                        elif tok[0] == '▁':
-                            # If the first sign is a "_" then we know that the word was not split 
-                            # up here but in the next one. We will add this word but we don't need the 
-                            # sign 
-                
-                            parsed += ' ' + tok[1:]
-                        elif '▁' not in tok:
-                            # if there is no sign here then the word was split up add this
-                            # character. We will add it to the parsed sentece with a space
-                            # and a sign
-                        
-                            parsed += ' ▁' + tok 
-                        else:
-                            # Nothing should end here
-                            sys.exit('Error in apply_sp_bpe.py this should not be here\n'+ tok)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from boundary_markers import format_sp_pieces
 
-                    except StopIteration:
-                        break
+def parse(i_path:str, o_stream:str, model, kaldi_text=True, separator='+', bm='lr', batch_size=10000, threads=1):
+    """Tokenize the lines of i_path in batches of batch_size lines, which SentencePiece encodes with
+    threads threads, and write them to o_stream. Returns the number of lines."""
+    n_lines = 0
+    with open(i_path) as f_in:
+        while True:
+            batch = list(islice(f_in, batch_size))
+            if not batch:
+                break
+            n_lines += len(batch)
 
-            # Lets change the format of the separtor
+            ids = []
+            lines = []
+            for line in batch:
+                if kaldi_text:
+                    ids.append(line.split(' ')[0])
+                    line = ' '.join(line.split(' ')[1:])
+                lines.append(line.rstrip())
 
-            if bm =='r':
-                parsed = re.sub(' ▁', f'{separator} ', parsed)
-            elif bm == 'lr':
-                parsed = re.sub(' ▁', f'{separator} {separator}', parsed)
-            elif bm == 'l':
-                parsed = re.sub(' ▁', f'{separator} ', parsed)
+            # always pass num_threads, SentencePiece's default (-1) uses every core of the machine
+            pieces = model.encode(lines, out_type=str, num_threads=threads)
 
+            out = []
+            for i, line_tok in enumerate(pieces):
+                logging.debug(line_tok)
+                parsed = format_sp_pieces(line_tok, separator, bm)
+                if kaldi_text:
+                    out.append(ids[i] + ' ' + parsed + '\n')
+                else:
+                    out.append(parsed + '\n')
+            o_stream.write(''.join(out))
 
-            if kaldi_text:
-                o_stream.write(id + ' ' + parsed+'\n')
-            else:
-                o_stream.write(parsed + '\n')    
+    return n_lines
 
 def boolean(s):
     if s not in {'False', 'True', 'false', 'true', "1", "0"}:
@@ -94,17 +71,29 @@ if __name__ == "__main__":
         help="Separator between non-final subword units (default: '%(default)s'))")
     parser.add_argument( '--boundary_marker', '-bm', type=str, default='lr', metavar='STR',
         help="Boundary marker (default: '%(default)s'))")
+    parser.add_argument('--threads', type=int, default=1, help='Number of threads SentencePiece encodes a batch with (default: %(default)s)')
+    parser.add_argument('--batch_size', type=int, default=10000, help='Number of lines encoded at a time (default: %(default)s)')
+    parser.add_argument('--log_level', type=str, default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+        help='DEBUG prints the pieces and the formatted text of every line (default: %(default)s)')
+    parser.add_argument('-q', '--quiet', action='store_true', help='Only log warnings and errors, same as --log_level WARNING')
 
     args = parser.parse_args()
-    
-    model = args.type 
-    
+
+    logging.basicConfig(level='WARNING' if args.quiet else args.log_level, format='%(message)s')
+
+    model = args.type
+
     sp = spm.SentencePieceProcessor()
     sp.load(args.model + '.model')
+    t0 = time.time()
     with open(args.output, 'w') as f_out:
-        parse(args.input, 
-            f_out, 
-            sp, 
-            args.type, 
-            args.separator, 
-            args.boundary_marker)
\ No newline at end of file
+        n_lines = parse(args.input,
+            f_out,
+            sp,
+            args.kaldi_text,
+            args.separator,
+            args.boundary_marker,
+            args.batch_size,
+            args.threads)
+    t1 = time.time()
+    logging.info(f'Tokenized {n_lines} lines in {t1-t0:.1f} sek ({n_lines/max(t1-t0, 1e-9):.0f} lines/s)')
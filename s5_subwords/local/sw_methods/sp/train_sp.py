@@ -3,6 +3,10 @@
 import sentencepiece as spm
 import time
 import argparse
+import random
+import resource
+from itertools import islice
+from math import exp, log, log1p
 
 def boolean_string(s):
     if s not in {'False', 'True', 'false', 'true', "1", "0"}:
@@ -17,6 +21,37 @@ def model_check(s):
         s = 'bpe'
     return s
 
+def _uniform(rng):
+    """A random number in (0, 1)"""
+    u = rng.random()
+    while u == 0.0:
+        u = rng.random()
+    return u
+
+def reservoir_sample(lines, k, seed=None):
+    """Uniformly sample k lines from the iterable lines in one pass, keeping only the sample in memory.
+    Uses Li's algorithm L, which draws random numbers only for the lines that enter the sample."""
+    rng = random.Random(seed)
+    lines = iter(lines)
+    sample = list(islice(lines, k))
+    if len(sample) < k:
+        return sample
+
+    w = exp(log(_uniform(rng))/k)
+    while True:
+        # number of lines to skip before the next one that replaces a random line in the sample
+        skip = int(log(_uniform(rng))/log1p(-w)) if w < 1.0 else 0
+        line = next(islice(lines, skip, None), None)
+        if line is None:
+            return sample
+        sample[rng.randrange(k)] = line
+        w *= exp(log(_uniform(rng))/k)
+
+def read_corpus(path):
+    with open(path) as f_in:
+        for line in f_in:
+            yield line.rstrip('\n')
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Create BPE/Unigram tokization model using the SentencePiece package')
     parser.add_argument('-i', '--training_corpus', required=True, help='Path to the text LM corpus')
@@ -25,12 +60,23 @@ if __name__ == "__main__":
     parser.add_argument('-l', '--larger_corpus', required=False, default=False, type=boolean_string, help='Parameter needed to be true when tranining on a very larger corpus, \
                                             has performance downsides if always true when not need. Should only be used with Unigram')
     parser.add_argument('-t', '--type', required=False, type=model_check, help='In the SentencePiece library we can train either a Unigram or BPE model')
+    parser.add_argument('-n', '--sample_size', required=False, type=int, default=4000000, help='Train on a uniform random sample of this many lines, \
+                                            drawn in one pass over the corpus. 0 trains on the whole corpus (default: %(default)s)')
+    parser.add_argument('--seed', required=False, type=int, default=0, help='Random seed for the sample (default: %(default)s)')
+    parser.add_argument('--threads', required=False, type=int, default=None, help='Number of threads SentencePiece trains with \
+                                            (default: the SentencePiece default)')
     args = parser.parse_args()
 
     t0 = time.time()
 
     model=args.type
 
+    if args.sample_size > 0:
+        sentences = reservoir_sample(read_corpus(args.training_corpus), args.sample_size, args.seed)
+        print(f'Sampled {len(sentences)} lines in {time.time()-t0:.1f} sek')
+    else:
+        sentences = read_corpus(args.training_corpus)
+
     print(f'Training a {model} model')
 
     # vocab_size - type: int32 default: 8000
@@ -46,13 +92,19 @@ if __name__ == "__main__":
     #--seed_sentencepiece_size: The size of seed pieces. This setting is valid when --model_type=unigram.
 
 
-    spm.SentencePieceTrainer.train(input=args.training_corpus, \
+    # num_threads is only passed when --threads is given, so that SentencePiece otherwise uses its own default
+    options = {} if args.threads is None else {'num_threads': args.threads}
+    # the sample is already drawn, so SentencePiece is given all of it (input_sentence_size 0)
+    spm.SentencePieceTrainer.train(sentence_iterator=iter(sentences), \
                                 model_prefix=args.output, \
                                 vocab_size=args.vocab_size, \
                                 model_type=model, \
-                                input_sentence_size = 4000000, \
+                                input_sentence_size = 0, \
                                 normalization_rule_name='identity', \
                                 max_sentencepiece_length=32, \
-                                train_extremely_large_corpus=args.larger_corpus) #Increase bit depth for unigram tokenization
+                                train_extremely_large_corpus=args.larger_corpus, \
+                                **options) #Increase bit depth for unigram tokenization
     t1 = time.time()
-    print(f"Training a {model} model {t1-t0} sek")
\ No newline at end of file
+    print(f"Training a {model} model {t1-t0} sek")
+    # ru_maxrss is in kilobytes on Linux
+    print(f"Peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024:.0f} MB")
@@ -9,6 +9,8 @@ export LC_ALL=C
 
 num_jobs=50
 num_decode_jobs=30
+# Number of processes used to subword tokenize the text corpus (stage 1)
+num_sw_workers=1
 stage=0
 create_venv=false
 
@@ -77,10 +79,9 @@ echo ===========================================================================
   # also has an implemation of the Unigram tokenizer. The fourth option is Morfessor. 
 
 
-  # Note: If you have a decent sized corpus > 4 million sentences, do create a subset of that
-  # corpus for this section and replace the input "$text_corpus" with that subset.
-  # e.g. "shuf $text_corpus | head -n 4000000 > $corpus_dir/base_subset_4m
-  # This limit is hard coded into the configs for the SP models.
+  # Note: The SP models are trained on a random sample of 4 million sentences from the corpus,
+  # drawn in one pass by train_sp.py. The sample size can be changed with --sample_size
+  # (0 uses the whole corpus).
   if [[ $method == 'bpe' ]]; then
     $train_cmd "$log/$method/${tag}_train.log" \
       local/sw_methods/bpe/learn_bpe.py -i $text_corpus \
@@ -95,7 +96,11 @@ echo ===========================================================================
             -o $model_dir/$tag \
 
   elif [[ $method == 'morfessor' ]]; then
-      echo "To do"
+    mkdir -p $model_dir/$tag
+    $train_cmd "$log/$method/${tag}_train.log" \
+      local/sw_methods/morfessor/train_morfessor.sh $text_corpus \
+        $sw_count \
+        $model_dir/$tag
   fi
 fi
 
@@ -104,32 +109,30 @@ echo ===========================================================================
 echo "               Subword tokeninzing text corpus with ${tag}        "
 echo ============================================================================
   if [[ $method == 'bpe' ]]; then
-    $train_cmd "$log/$method/${tag}_apply.log" \
+    $train_cmd --num-threads $num_sw_workers "$log/$method/${tag}_apply.log" \
       local/sw_methods/bpe/apply_bpe.py -i $text_corpus \
         --codes $model_dir/${tag}_pair_codes \
         -s $sw_separator \
-        -o $corpus_dir/$method/${tag}_tmp
-
-    echo "The boundary marker is r and is being changed to ${boundary_marker}"
-    if [[ $boundary_marker == r ]]; then
-      mv $corpus_dir/$method/${tag}_tmp $corpus_dir/$method/$tag
-    else 
-      local/sw_methods/change_boundary_marking_style.py $corpus_dir/$method/${tag}_tmp \
-        $boundary_marker \
-        $sw_separator \
-        > $corpus_dir/$method/$tag
-        rm $corpus_dir/$method/${tag}_tmp
-    fi
-    
+        -bm $boundary_marker \
+        --num-workers $num_sw_workers \
+        -o $corpus_dir/$method/$tag
+
   elif [[ $method == 'unigram' || $method == 'sp_bpe' ]]; then
-    $train_cmd --mem 6G "$log/$method/${tag}_applying.log" \
+    $train_cmd --mem 6G --num-threads $num_sw_workers "$log/$method/${tag}_applying.log" \
       local/sw_methods/sp/apply_sp.py -i $text_corpus \
         -m $model_dir/$tag \
         -bm $boundary_marker \
+        --threads $num_sw_workers \
         -o $corpus_dir/$method/$tag
 
   elif [[ $method == 'morfessor' ]]; then
-    echo "To do"
+    $train_cmd --num-threads $num_sw_workers "$log/$method/${tag}_apply.log" \
+      local/sw_methods/morfessor/apply_morfessor.sh --separator $sw_separator \
+        --boundary-marker $boundary_marker \
+        --nj $num_sw_workers \
+        $text_corpus \
+        $model_dir/$tag \
+        $corpus_dir/$method/$tag
 
   fi
 fi